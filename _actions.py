@@ -0,0 +1,30 @@
+import numpy as np
+
+# Every action is a row of (move, rotate, shoot): move and rotate are -1, 0 or 1 times the agent's
+# speed and rotation speed, shoot is 1 to fire. Q-table columns follow the row order.
+MOVE, ROTATE, SHOOT = 0, 1, 2
+
+GAME_ACTIONS = np.array([
+    [0, 0, 0],    # Do nothing
+    [1, 0, 0],    # Move forward
+    [-1, 0, 0],   # Move backward
+    [0, -1, 0],   # Rotate left
+    [0, 1, 0],    # Rotate right
+    [0, 0, 1],    # Shoot
+    [1, -1, 0],   # Move forward and rotate left
+    [1, 1, 0],    # Move forward and rotate right
+    [-1, -1, 0],  # Move backward and rotate left
+    [-1, 1, 0],   # Move backward and rotate right
+], dtype=np.int64)
+GAME_DO_NOTHING = 0
+
+# Actions of the turrets in _precision.py, _targeting.py and _vector_env.py, which never move
+TURRET_ACTIONS = np.array([
+    [0, -1, 0],  # Rotate left
+    [0, 1, 0],   # Rotate right
+    [0, 0, 1],   # Shoot
+], dtype=np.int64)
+TURRET_ACTION_NAMES = ['rotate_left', 'rotate_right', 'shoot']  # As stored in older turret models
+
+GAME_ACTIONS.flags.writeable = False
+TURRET_ACTIONS.flags.writeable = False
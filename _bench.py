@@ -0,0 +1,324 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import pygame
+
+import _game
+import _precision
+import _targeting
+from _qtable import QTable
+from _replay import ReplayBuffer
+from _learner import Learner
+from _vector_env import VectorEnv
+from _checkpoint import save_checkpoint, load_checkpoint, append_delta
+
+RESULTS_FILE = 'bench.json'
+SEED = 0
+REPEAT = 3  # Each measurement is run this many times and the fastest run is reported
+
+# Parameter sweeps: full runs and --quick runs
+SWEEPS = {
+    'game': {'enemies': [1, 3, 10], 'extra_walls': [0, 20, 100]},
+    'game_env': {'envs': [1, 8, 32]},
+    'precision': {'players': [1, 5, 20]},
+    'targeting': {'players': [1, 10, 40], 'enemies': [1, 3, 10]},
+    'vector_env': {'envs': [1, 64, 1024], 'enemies': [3, 10], 'walls': [0, 20]},
+    'q_update': {'states': [1000, 100000, 1000000]},
+    'replay_sample': {'capacity': [10000, 1000000], 'batch': [32, 256, 4096]},
+    'checkpoint': {'states': [1000, 100000, 1000000]},
+    'draw_view': {'walls': [0, 20, 100]},
+}
+QUICK_SWEEPS = {
+    'game': {'enemies': [3], 'extra_walls': [0]},
+    'game_env': {'envs': [8]},
+    'precision': {'players': [5]},
+    'targeting': {'players': [10], 'enemies': [3]},
+    'vector_env': {'envs': [64], 'enemies': [3], 'walls': [0]},
+    'q_update': {'states': [10000]},
+    'replay_sample': {'capacity': [100000], 'batch': [256]},
+    'checkpoint': {'states': [10000]},
+    'draw_view': {'walls': [0]},
+}
+
+
+def best_time(run, repeat):
+    # Fastest of `repeat` calls of run(), which does the measured work and returns how many units it did
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        units = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return units, best
+
+
+def random_walls(count, width, height, rng):
+    # Short horizontal and vertical wall segments scattered over the arena
+    walls = []
+    for _ in range(count):
+        length = int(rng.integers(20, 120))
+        horizontal = rng.random() < 0.5
+        w, h = (length, 10) if horizontal else (10, length)
+        walls.append(pygame.Rect(int(rng.integers(0, width - w)), int(rng.integers(0, height - h)), w, h))
+    return walls
+
+
+def filled_q_table(n_states, n_actions, rng):
+    q_table = QTable(n_actions, capacity=n_states)
+    for state in range(n_states):
+        q_table.row(state)
+    q_table.values[:n_states] = rng.standard_normal((n_states, n_actions))
+    return q_table
+
+
+def extended_map(extra_walls, seed):
+    # The default map with `extra_walls` random walls added
+    game_map = _game.default_map()
+    if not extra_walls:
+        return game_map
+    walls = list(game_map.walls) + random_walls(extra_walls, _game.SCREEN_WIDTH, _game.SCREEN_HEIGHT,
+                                                np.random.default_rng(seed))
+    return _game.GameMap(walls, game_map.doors)
+
+
+def bench_game(steps, repeat, seed, enemies, extra_walls):
+    game = _game.Game(q_table=QTable(_game.N_ACTIONS), enemy_count=enemies, seed=seed,
+                      game_map=extended_map(extra_walls, seed))
+
+    def run():
+        for _ in range(steps):
+            game.step()
+        return steps
+    return best_time(run, repeat), 'steps'
+
+
+def bench_game_env(steps, repeat, seed, envs):
+    env = _game.GameEnv(envs, seed=seed)
+    env.reset()
+    actions = np.random.default_rng(seed).integers(0, env.n_actions, size=(steps, envs))
+
+    def run():
+        for step_actions in actions:
+            env.step(step_actions)
+        return steps * envs
+    return best_time(run, repeat), 'agent_steps'
+
+
+def bench_precision(steps, repeat, seed, players):
+    arena = _precision.Arena(QTable(len(_precision.TURRET_ACTIONS)), player_count=players, seed=seed)
+
+    def run():
+        for _ in range(steps):
+            if arena.is_game_over():
+                arena.reset()
+            arena.step()
+        return steps * players
+    return best_time(run, repeat), 'agent_steps'
+
+
+def bench_targeting(steps, repeat, seed, players, enemies):
+    learner = Learner(QTable(len(_targeting.TURRET_ACTIONS)), _targeting.REPLAY_BUFFER_SIZE, _targeting.BATCH_SIZE,
+                      _targeting.REPLAY_RATIO, _targeting.ALPHA, _targeting.GAMMA, np.random.default_rng(seed))
+    arena = _targeting.Arena(learner, player_count=players, enemy_count=enemies, seed=seed)
+
+    def run():
+        for _ in range(steps):
+            if arena.is_game_over():
+                arena.reset()
+            arena.step()
+        return steps * players
+    return best_time(run, repeat), 'agent_steps'
+
+
+def bench_vector_env(steps, repeat, seed, envs, enemies, walls):
+    rng = np.random.default_rng(seed)
+    wall_rects = [tuple(wall) for wall in random_walls(walls, 500, 500, rng)]
+    env = VectorEnv(envs, n_enemies=enemies, walls=wall_rects, seed=seed)
+    actions = rng.integers(0, 3, size=(steps, envs))
+
+    def run():
+        for step_actions in actions:
+            env.step(step_actions)
+        return steps * envs
+    return best_time(run, repeat), 'agent_steps'
+
+
+def bench_q_update(steps, repeat, seed, states):
+    # Scalar updates as the per-step agents do them, then batched updates as the learners do
+    rng = np.random.default_rng(seed)
+    q_table = filled_q_table(states, _game.N_ACTIONS, rng)
+    state_ids = rng.integers(0, states, size=(steps, 2)).tolist()
+    actions = rng.integers(0, _game.N_ACTIONS, size=steps).tolist()
+
+    def run_scalar():
+        for (state, next_state), action in zip(state_ids, actions):
+            q_table.update(state, action, 1.0, next_state, _game.ALPHA, _game.GAMMA)
+        return steps
+
+    batch = _targeting.BATCH_SIZE
+    rows = rng.integers(0, states, size=(steps, 2, batch))
+    batch_actions = rng.integers(0, _game.N_ACTIONS, size=(steps, batch))
+    rewards = rng.standard_normal(batch)
+
+    def run_batch():
+        for (state_rows, next_rows), step_actions in zip(rows, batch_actions):
+            q_table.update_batch(state_rows, step_actions, rewards, next_rows, _game.ALPHA, _game.GAMMA)
+        return steps * batch
+    return [(best_time(run_scalar, repeat), 'updates', {'mode': 'scalar'}),
+            (best_time(run_batch, repeat), 'updates', {'mode': 'batch', 'batch': batch})]
+
+
+def bench_replay_sample(steps, repeat, seed, capacity, batch):
+    rng = np.random.default_rng(seed)
+    buffer = ReplayBuffer(capacity, rng=np.random.default_rng(seed))
+    buffer.extend(rng.integers(0, 1000, capacity), rng.integers(0, 3, capacity),
+                  rng.standard_normal(capacity), rng.integers(0, 1000, capacity))
+
+    def run():
+        for _ in range(steps):
+            buffer.sample(batch)
+        return steps * batch
+    return best_time(run, repeat), 'transitions'
+
+
+def bench_checkpoint(steps, repeat, seed, states):
+    rng = np.random.default_rng(seed)
+    q_table = filled_q_table(states, _game.N_ACTIONS, rng)
+    lookups = rng.integers(0, states, size=1000).tolist()
+    dirty = rng.choice(states, size=max(1, states // 100), replace=False)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.qtc')
+
+        def run_save():
+            save_checkpoint(path, q_table, keep=1)
+            return states
+
+        def run_load():
+            # Loading maps the file; the lookups pay for the pages and base searches they touch
+            loaded, _ = load_checkpoint(path)
+            for state in lookups:
+                loaded.lookup(state)
+            return states
+
+        def run_delta():
+            append_delta(path, 'bench', q_table.row_keys(dirty), q_table.values[dirty])
+            return len(dirty)
+
+        saved = best_time(run_save, repeat)
+        size = os.path.getsize(path)
+        return [(saved, 'states', {'operation': 'save', 'bytes': size}),
+                (best_time(run_load, repeat), 'states', {'operation': 'load', 'lookups': len(lookups)}),
+                (best_time(run_delta, repeat), 'states', {'operation': 'delta', 'dirty': len(dirty)})]
+
+
+def bench_draw_view(steps, repeat, seed, walls):
+    game = _game.Game(q_table=QTable(_game.N_ACTIONS), seed=seed, game_map=extended_map(walls, seed))
+    surface = pygame.Surface((_game.SCREEN_WIDTH, _game.SCREEN_HEIGHT))
+    player = game.player
+
+    def run():
+        for i in range(steps):
+            player.angle = (5 * i) % 360
+            player.draw_view(surface, game.occupancy)
+        return steps
+    return best_time(run, repeat), 'frames'
+
+
+# name -> (function, steps per measurement in a full run)
+BENCHMARKS = {
+    'game': (bench_game, 2000),
+    'game_env': (bench_game_env, 500),
+    'precision': (bench_precision, 1000),
+    'targeting': (bench_targeting, 500),
+    'vector_env': (bench_vector_env, 500),
+    'q_update': (bench_q_update, 20000),
+    'replay_sample': (bench_replay_sample, 2000),
+    'checkpoint': (bench_checkpoint, 1),
+    'draw_view': (bench_draw_view, 500),
+}
+
+
+def sweep(grid):
+    # Every combination of the parameter lists in `grid`
+    combinations = [{}]
+    for name, values in grid.items():
+        combinations = [{**params, name: value} for params in combinations for value in values]
+    return combinations
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(names, quick=False, seed=SEED, repeat=REPEAT):
+    sweeps = QUICK_SWEEPS if quick else SWEEPS
+    results = []
+    for name in names:
+        function, steps = BENCHMARKS[name]
+        if quick:
+            steps = max(1, steps // 10)
+        for params in sweep(sweeps[name]):
+            measured = function(steps, repeat, seed, **params)
+            if not isinstance(measured, list):
+                measured = [(*measured, {})]
+            for (units, seconds), unit, extra in measured:
+                result = {
+                    'benchmark': name,
+                    'params': {**params, **extra},
+                    'unit': unit,
+                    'count': units,
+                    'seconds': seconds,
+                    'per_second': units / seconds if seconds else None,
+                }
+                results.append(result)
+                print(f'{name:14} {json.dumps(result["params"]):60} {result["per_second"]:14,.0f} {unit}/s')
+    return results
+
+
+def main(names, out, quick=False, seed=SEED, repeat=REPEAT):
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'seed': seed,
+        'repeat': repeat,
+        'quick': quick,
+        'results': run_benchmarks(names, quick, seed, repeat),
+    }
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {out}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the environments, learning updates, checkpoints and rendering")
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f'benchmarks to run (default: all of {", ".join(BENCHMARKS)})')
+    parser.add_argument('--out', default=RESULTS_FILE, help='JSON file to write the results to')
+    parser.add_argument('--quick', action='store_true', help='one small configuration per benchmark')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed for every random source the benchmarks use')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per measurement; the fastest is reported')
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args.benchmarks or list(BENCHMARKS), args.out, args.quick, args.seed, args.repeat)
@@ -0,0 +1,121 @@
+import pygame
+import numpy as np
+
+BULLET_CAPACITY = 64
+SCALAR_BULLETS = 32  # Below this many live bullets a plain Rect loop beats the fixed cost of the array path
+
+NO_HITS = np.zeros(0, dtype=bool)
+NO_ENEMY_HITS = np.zeros(0, dtype=np.int64)
+NO_HITS.flags.writeable = False
+NO_ENEMY_HITS.flags.writeable = False
+
+
+class BulletPool:
+    """Fixed-capacity bullet store kept as parallel arrays; live bullets occupy the first `count` slots.
+
+    Positions follow pygame.Rect conventions: (x, y) is the integer top-left corner of a
+    `size` x `size` square, moved by its rounded velocity every step.
+    """
+    def __init__(self, size, screen_width, screen_height, color, capacity=BULLET_CAPACITY):
+        self.size = size
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.color = color
+        self.x = np.zeros(capacity, dtype=np.int64)
+        self.y = np.zeros(capacity, dtype=np.int64)
+        self.dx = np.zeros(capacity, dtype=np.int64)
+        self.dy = np.zeros(capacity, dtype=np.int64)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def spawn(self, x, y, dx, dy):
+        # Returns False when the pool is full and the shot is dropped
+        i = self.count
+        if i == len(self.x):
+            return False
+        self.x[i], self.y[i] = x, y
+        self.dx[i], self.dy[i] = round(dx), round(dy)
+        self.count = i + 1
+        return True
+
+    def clear(self):
+        self.count = 0
+
+    def step(self, enemy_rects=(), walls=None):
+        """Move every live bullet and hit-test all of them in one pass.
+
+        Returns per-bullet masks for bullets that left the screen or hit a wall, and the index of
+        the first enemy in `enemy_rects` each bullet hit (-1 for none). Bullets that hit anything
+        are removed. Bullets are resolved simultaneously, so two bullets can hit the same enemy.
+        """
+        n = self.count
+        if not n:
+            return NO_HITS, NO_HITS, NO_ENEMY_HITS
+        if n < SCALAR_BULLETS:
+            return self._step_scalar(enemy_rects, walls)
+        x, y = self.x[:n], self.y[:n]
+        x += self.dx[:n]
+        y += self.dy[:n]
+        size = self.size
+
+        off_screen = ~((0 <= x) & (x <= self.screen_width) & (0 <= y) & (y <= self.screen_height))
+        if walls is not None:
+            hit_wall = ~off_screen & walls.collides_many(x, y, size, size)
+        else:
+            hit_wall = np.zeros(n, dtype=bool)
+
+        hit_enemy = np.full(n, -1, dtype=np.int64)
+        if len(enemy_rects):
+            enemies = np.array([(e.x, e.y, e.width, e.height) for e in enemy_rects], dtype=np.int64)
+            overlap = ((x[:, None] < enemies[:, 0] + enemies[:, 2]) & (enemies[:, 0] < x[:, None] + size)
+                       & (y[:, None] < enemies[:, 1] + enemies[:, 3]) & (enemies[:, 1] < y[:, None] + size))
+            overlap &= ~(off_screen | hit_wall)[:, None]
+            hit_enemy = np.where(overlap.any(axis=1), overlap.argmax(axis=1), -1)
+
+        self._compact(~off_screen & ~hit_wall & (hit_enemy < 0))
+        return off_screen, hit_wall, hit_enemy
+
+    def _step_scalar(self, enemy_rects, walls):
+        # Same results as the array path, one pygame.Rect at a time
+        n = self.count
+        xs, ys = self.x[:n].tolist(), self.y[:n].tolist()
+        dxs, dys = self.dx[:n].tolist(), self.dy[:n].tolist()
+        size = self.size
+        width, height = self.screen_width, self.screen_height
+        off_screen = []
+        hit_wall = []
+        hit_enemy = []
+        kept = 0
+        for x, y, dx, dy in zip(xs, ys, dxs, dys):
+            x += dx
+            y += dy
+            off = not (0 <= x <= width and 0 <= y <= height)
+            wall = False
+            hit = -1
+            if not off:
+                rect = pygame.Rect(x, y, size, size)
+                wall = walls is not None and walls.collides(rect)
+                if not wall:
+                    hit = rect.collidelist(enemy_rects)
+            off_screen.append(off)
+            hit_wall.append(wall)
+            hit_enemy.append(hit)
+            if not (off or wall or hit >= 0):
+                self.x[kept], self.y[kept], self.dx[kept], self.dy[kept] = x, y, dx, dy
+                kept += 1
+        self.count = kept
+        return np.array(off_screen), np.array(hit_wall), np.array(hit_enemy, dtype=np.int64)
+
+    def _compact(self, keep):
+        # Move surviving bullets to the front so live slots stay contiguous
+        kept = int(keep.sum())
+        if kept < self.count:
+            for column in (self.x, self.y, self.dx, self.dy):
+                column[:kept] = column[:self.count][keep]
+            self.count = kept
+
+    def draw(self, surface):
+        for x, y in zip(self.x[:self.count].tolist(), self.y[:self.count].tolist()):
+            pygame.draw.rect(surface, self.color, (x, y, self.size, self.size))
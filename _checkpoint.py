@@ -0,0 +1,370 @@
+import os
+import json
+import zlib
+import pickle
+import shutil
+import struct
+import argparse
+import functools
+import contextlib
+import threading
+
+import numpy as np
+
+from _qtable import QTable, key_view
+from _actions import TURRET_ACTION_NAMES
+
+# File layout: MAGIC, u64 header length, JSON header, then the sorted float64 state keys and the
+# float32 Q-values as raw C-ordered arrays at the offsets recorded in the header.
+MAGIC = b'CQBQTAB\x00'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+KEEP_CHECKPOINTS = 3  # The current checkpoint plus the previous ones as path.1, path.2, ...
+
+# Delta log next to a checkpoint: DELTA_MAGIC and the id of the checkpoint it extends, then appended
+# segments of changed rows, each a SEGMENT_HEADER followed by its keys and values.
+DELTA_SUFFIX = '.delta'
+DELTA_MAGIC = b'CQBDELTA'
+CHECKPOINT_ID_BYTES = 8
+SEGMENT_HEADER = struct.Struct('<QQQI')  # Rows, key width, actions, CRC-32 of the keys and values
+COMPACT_FRACTION = 0.5  # Rewrite the full checkpoint once the delta log holds this many rows per checkpoint row
+
+KEY_TYPES = {'int': int, 'float': float}
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _key_type_names(state):
+    values = state if isinstance(state, tuple) else (state,)
+    return ['int' if isinstance(v, (int, np.integer)) and not isinstance(v, bool) else 'float' for v in values]
+
+
+def new_checkpoint_id():
+    return os.urandom(CHECKPOINT_ID_BYTES).hex()
+
+
+def delta_path(path):
+    return path + DELTA_SUFFIX
+
+
+@contextlib.contextmanager
+def atomic_write(path, before_replace=None):
+    """Write `path` through a temporary file that is synced to disk and then renamed over it.
+
+    A crash never leaves a partial file at `path`, and anything still mapping the old file keeps it.
+    `before_replace` runs between the sync and the rename.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+    if before_replace is not None:
+        before_replace()
+    os.replace(tmp_path, path)
+
+
+def save_checkpoint(path, q_table, metadata=None, keep=KEEP_CHECKPOINTS, checkpoint_id=None):
+    n = len(q_table)
+    keys = q_table.row_keys(np.arange(n))
+    order = np.argsort(key_view(keys), kind='stable') if n else np.zeros(0, dtype=np.int64)
+    keys = np.ascontiguousarray(keys[order])
+    values = np.ascontiguousarray(q_table.values[:n][order], dtype=np.float32)
+    key_info = {**key_header(q_table), 'checkpoint_id': checkpoint_id or new_checkpoint_id()}
+    write_arrays(path, keys, values, key_info, metadata, keep)
+
+
+def _copy_into_place(src, dst, link=False):
+    # Hard link or copy `src` to a temporary name and rename it over `dst`, leaving `src` untouched
+    tmp_path = dst + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if link:
+        try:
+            os.link(src, tmp_path)
+        except OSError:  # No hard links on this filesystem
+            link = False
+    if not link:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def rotate_checkpoints(path, keep):
+    # path.1 -> path.2 ...; the oldest of the `keep` files is overwritten and `path` is copied to path.1.
+    # `path` itself stays in place until the caller swaps the new checkpoint over it, so some intact
+    # checkpoint is on disk at every point. A delta log moves with its checkpoint.
+    for i in range(keep - 1, 0, -1):
+        older = path if i == 1 else f'{path}.{i - 1}'
+        newer = f'{path}.{i}'
+        if os.path.exists(older):
+            # Checkpoints are only ever replaced, never written in place, so a link is a safe copy.
+            # Delta logs are appended to and truncated in place, so they get a real copy.
+            if i == 1:
+                _copy_into_place(older, newer, link=True)
+            else:
+                os.replace(older, newer)
+        if os.path.exists(delta_path(older)):
+            if i == 1:
+                _copy_into_place(delta_path(older), delta_path(newer))
+            else:
+                os.replace(delta_path(older), delta_path(newer))
+        elif os.path.exists(delta_path(newer)):
+            os.remove(delta_path(newer))
+
+
+def key_header(q_table):
+    if q_table.base_size:
+        types = ['int' if t is int else 'float' for t in q_table.key_types]
+        return {'key_types': types, 'key_tuple': q_table.key_tuple}
+    if q_table.states:
+        state = q_table.states[0]
+        return {'key_types': _key_type_names(state), 'key_tuple': isinstance(state, tuple)}
+    return {'key_types': [], 'key_tuple': True}
+
+
+def write_arrays(path, keys, values, key_info, metadata=None, keep=KEEP_CHECKPOINTS):
+    header = {
+        'format_version': FORMAT_VERSION,
+        'n_states': len(values),
+        'n_actions': values.shape[1],
+        'key_width': keys.shape[1] if keys.ndim == 2 else 0,
+        **key_info,
+        'metadata': metadata or {},
+    }
+    # The offsets are part of the header, so grow the reserved header space until it fits
+    header_size = ALIGNMENT
+    while True:
+        header['keys_offset'] = header_size
+        header['values_offset'] = _align(header_size + keys.nbytes)
+        blob = json.dumps(header).encode('utf-8')
+        if len(MAGIC) + 8 + len(blob) <= header_size:
+            break
+        header_size = _align(len(MAGIC) + 8 + len(blob))
+
+    # A table loaded from `path` keeps mapping the old checkpoint
+    with atomic_write(path, functools.partial(rotate_checkpoints, path, keep)) as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(blob)))
+        f.write(blob)
+        f.write(b'\x00' * (header['keys_offset'] - f.tell()))
+        f.write(keys.tobytes())
+        f.write(b'\x00' * (header['values_offset'] - f.tell()))
+        f.write(values.tobytes())
+    # The new checkpoint starts without a delta log. One left behind by a crash before this point
+    # carries the old checkpoint id, so it is ignored on load and overwritten on the next append.
+    if os.path.exists(delta_path(path)):
+        os.remove(delta_path(path))
+
+
+def append_delta(path, checkpoint_id, keys, values):
+    """Append changed rows to the delta log of the checkpoint at `path`, whose id is `checkpoint_id`."""
+    file_header = DELTA_MAGIC + checkpoint_id.encode('ascii')
+    log_path = delta_path(path)
+    mode = 'ab'
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            if f.read(len(file_header)) != file_header:
+                mode = 'wb'  # Left over from an older checkpoint
+    payload = np.ascontiguousarray(keys, dtype=np.float64).tobytes() + \
+        np.ascontiguousarray(values, dtype=np.float32).tobytes()
+    with open(log_path, mode) as f:
+        if f.tell() == 0:
+            f.write(file_header)
+        f.write(SEGMENT_HEADER.pack(len(keys), keys.shape[1], values.shape[1], zlib.crc32(payload)))
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_deltas(path, checkpoint_id):
+    # (keys, values) of each intact segment in append order; a torn or corrupt tail left by a crash is dropped
+    try:
+        with open(delta_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    file_header = DELTA_MAGIC + checkpoint_id.encode('ascii')
+    if not data.startswith(file_header):
+        return
+    offset = len(file_header)
+    while offset + SEGMENT_HEADER.size <= len(data):
+        n, width, n_actions, crc = SEGMENT_HEADER.unpack_from(data, offset)
+        start = offset + SEGMENT_HEADER.size
+        values_start = start + n * width * 8
+        end = values_start + n * n_actions * 4
+        if end > len(data) or zlib.crc32(data[start:end]) != crc:
+            return
+        keys = np.frombuffer(data, dtype=np.float64, count=n * width, offset=start).reshape(n, width)
+        values = np.frombuffer(data, dtype=np.float32, count=n * n_actions, offset=values_start).reshape(n, n_actions)
+        yield keys, values
+        offset = end
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a Q-table checkpoint')
+        (length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode('utf-8'))
+    if header['format_version'] > FORMAT_VERSION:
+        raise ValueError(f'{path} has checkpoint format {header["format_version"]}, '
+                         f'this version reads up to {FORMAT_VERSION}')
+    return header
+
+
+def load_checkpoint(path):
+    """Memory-map a checkpoint and replay its delta log; returns the Q-table and the metadata saved with it.
+
+    Q-values are mapped copy-on-write, so loading is near-instant and training never writes back to the file.
+    """
+    header = read_header(path)
+    n = header['n_states']
+    if not n:
+        return QTable(header['n_actions']), header['metadata']
+    keys = np.memmap(path, dtype=np.float64, mode='r', offset=header['keys_offset'],
+                     shape=(n, header['key_width']))
+    values = np.memmap(path, dtype=np.float32, mode='c', offset=header['values_offset'],
+                       shape=(n, header['n_actions']))
+    key_types = [KEY_TYPES[name] for name in header['key_types']]
+    q_table = QTable.from_base(keys, values, key_types, header['key_tuple'])
+    if 'checkpoint_id' in header:
+        for delta_keys, delta_values in read_deltas(path, header['checkpoint_id']):
+            for key, row_values in zip(delta_keys, delta_values):
+                row = q_table.row(q_table.decode_key(key))  # May grow q_table.values
+                q_table.values[row] = row_values
+        q_table.take_dirty()
+    return q_table, header['metadata']
+
+
+class CheckpointWriter:
+    """Saves Q-table snapshots on a background thread so training does not wait for the disk.
+
+    Each save appends only the rows changed since the previous one to the checkpoint's delta log,
+    and rewrites the full checkpoint once the log holds `compact_fraction` times as many rows.
+    """
+    def __init__(self, path, metadata=None, keep=KEEP_CHECKPOINTS, compact_fraction=COMPACT_FRACTION):
+        self.path = path
+        self.metadata = metadata
+        self.keep = keep
+        self.compact_fraction = compact_fraction
+        self.checkpoint_id = None
+        self.checkpoint_rows = 0  # Rows in the last full checkpoint; deltas need a non-empty one to extend
+        self.delta_rows = 0
+        self.evicted = 0  # q_table.evicted at the last full checkpoint
+        self.jobs = []
+        self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, q_table):
+        if self.error is not None:
+            raise self.error
+        # Deltas can only add or change states, so states evicted since the last checkpoint need a full one
+        compact = (not self.checkpoint_rows or self.delta_rows > self.compact_fraction * self.checkpoint_rows
+                   or q_table.evicted != self.evicted)
+        rows = q_table.take_dirty()
+        if compact:
+            self.checkpoint_id = new_checkpoint_id()
+            self.checkpoint_rows = len(q_table)
+            self.delta_rows = 0
+            self.evicted = q_table.evicted
+            job = functools.partial(save_checkpoint, self.path, q_table.copy(), self.metadata, self.keep,
+                                    self.checkpoint_id)
+        elif len(rows):
+            self.delta_rows += len(rows)
+            job = functools.partial(append_delta, self.path, self.checkpoint_id,
+                                    q_table.row_keys(rows), q_table.values[rows])
+        else:
+            return
+        with self.condition:
+            if compact:
+                self.jobs.clear()  # The full snapshot already contains any deltas still queued
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.jobs and not self.closed:
+                    self.condition.wait()
+                if not self.jobs:
+                    return
+                job = self.jobs.pop(0)
+            try:
+                job()
+            except Exception as error:
+                self.error = error
+
+    def close(self):
+        # Wait for the queued saves to be written
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def table_from_legacy(legacy, n_actions, actions=None):
+    # Legacy pickles are either {state: [q per action]} or {(state, action_name): q}
+    first_key = next(iter(legacy), None)
+    if isinstance(first_key, tuple) and len(first_key) == 2 and isinstance(first_key[1], str):
+        return QTable.from_pairs(legacy, actions or TURRET_ACTION_NAMES)
+    return QTable.from_dict(legacy, n_actions)
+
+
+def checkpoint_paths(path):
+    # `path` and its existing backups path.1, path.2, ..., newest first
+    paths = [path]
+    i = 1
+    while os.path.exists(f'{path}.{i}'):
+        paths.append(f'{path}.{i}')
+        i += 1
+    return paths
+
+
+def load_q_table(path, legacy_path, n_actions, actions=None):
+    """Load the newest intact checkpoint of `path`, else convert the legacy pickle at `legacy_path`, else start empty."""
+    for checkpoint in checkpoint_paths(path):
+        if not os.path.exists(checkpoint):
+            continue
+        try:
+            return load_checkpoint(checkpoint)[0]
+        except (OSError, ValueError, KeyError, struct.error) as error:
+            print(f'Skipping unreadable checkpoint {checkpoint}: {error}')
+    if legacy_path is not None and os.path.exists(legacy_path):
+        with open(legacy_path, 'rb') as f:
+            return table_from_legacy(pickle.load(f), n_actions, actions)
+    return QTable(n_actions)
+
+
+def convert_pickle(pickle_path, checkpoint_path, actions=None):
+    with open(pickle_path, 'rb') as f:
+        legacy = pickle.load(f)
+    if not legacy:
+        raise ValueError(f'{pickle_path} is empty, nothing to convert')
+    first_value = next(iter(legacy.values()))
+    n_actions = len(first_value) if isinstance(first_value, list) else len(actions or TURRET_ACTION_NAMES)
+    q_table = table_from_legacy(legacy, n_actions, actions)
+    save_checkpoint(checkpoint_path, q_table, {'converted_from': os.path.basename(pickle_path)})
+    return q_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert a legacy models/*.pkl Q-table into a .qtc checkpoint")
+    parser.add_argument('pickle_path', help='legacy pickled Q-table')
+    parser.add_argument('checkpoint_path', nargs='?', help='output checkpoint (default: same name with .qtc)')
+    parser.add_argument('--actions', nargs='+', default=None,
+                        help=f'action names in column order for (state, action) pickles (default: {" ".join(TURRET_ACTION_NAMES)})')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    checkpoint_path = args.checkpoint_path or os.path.splitext(args.pickle_path)[0] + '.qtc'
+    q_table = convert_pickle(args.pickle_path, checkpoint_path, args.actions)
+    print(f'{args.pickle_path} -> {checkpoint_path}: {len(q_table)} states x {q_table.n_actions} actions')
@@ -0,0 +1,15 @@
+class StepClock:
+    """Simulation clock owned by the environment; time is counted in steps, not milliseconds."""
+    def __init__(self):
+        self.ticks = 0
+
+    def tick(self):
+        self.ticks += 1
+
+    def reset(self):
+        self.ticks = 0
+
+
+def ms_to_steps(ms, fps):
+    # Convert a real-time duration into the number of steps it lasts at the given frame rate
+    return round(ms * fps / 1000)
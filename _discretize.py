@@ -0,0 +1,89 @@
+from bisect import bisect_right
+
+import numpy as np
+
+from _qtable import QTable
+
+
+def uniform_edges(low, high, step):
+    # Edges of `step`-wide bins centred on low, low + step, ..., high, i.e. the bins of rounding to `step`
+    n = int(round((high - low) / step))
+    return low + step * (np.arange(n) + 0.5)
+
+
+class Discretizer:
+    """Maps feature vectors to one integer state id, binning each feature by its own sorted edges.
+
+    A feature falls in bin i when edges[i - 1] <= value < edges[i], as np.digitize counts it, and the
+    per-feature bins are combined in mixed radix. A batch is binned with one searchsorted per feature;
+    a single feature vector is binned in plain Python, which is cheaper for one. Both compare values
+    against the edges themselves, so they agree exactly, values on an edge included.
+    """
+    def __init__(self, edges):
+        edges = [np.asarray(feature_edges, dtype=np.float64) for feature_edges in edges]
+        self.n_bins = np.array([len(feature_edges) + 1 for feature_edges in edges])
+        self.n_states = int(np.prod(self.n_bins))
+        # Mixed-radix place value of each feature, the last feature varying fastest
+        self.strides = np.cumprod(np.concatenate([self.n_bins[1:], [1]])[::-1])[::-1].astype(np.int64)
+
+        self.edges = edges
+
+        # Per feature: first edge, edges per unit (0 when the edges are not evenly spaced), edges, edge count
+        # and stride
+        self.scalar_bins = []
+        for feature_edges, stride in zip(edges, self.strides.tolist()):
+            spacing = np.diff(feature_edges)
+            uniform = len(spacing) and np.allclose(spacing, spacing[0])
+            self.scalar_bins.append((float(feature_edges[0]), 1 / float(spacing[0]) if uniform else 0.0,
+                                     feature_edges.tolist(), len(feature_edges), stride))
+
+    def bins(self, features):
+        # Bin index of every feature, same shape as `features`
+        bins = np.empty(features.shape, dtype=np.int64)
+        for i, feature_edges in enumerate(self.edges):
+            bins[..., i] = np.searchsorted(feature_edges, features[..., i], side='right')
+        return bins
+
+    def state(self, features):
+        state = 0
+        for value, (first, scale, edges, n_edges, stride) in zip(features, self.scalar_bins):
+            if scale:
+                # Estimate the bin from the spacing, then settle it against the edges themselves so
+                # rounding can't disagree with searchsorted
+                b = int((value - first) * scale) + 1
+                if b < 0:
+                    b = 0
+                elif b > n_edges:
+                    b = n_edges
+                while b and edges[b - 1] > value:
+                    b -= 1
+                while b < n_edges and edges[b] <= value:
+                    b += 1
+            else:
+                b = bisect_right(edges, value)
+            state += b * stride
+        return state
+
+    def states(self, features):
+        # State ids of an (n, n_features) batch
+        return self.bins(np.asarray(features, dtype=np.float64)) @ self.strides
+
+    def rekey(self, q_table, features):
+        # Q-table keyed by state id, from one that keyed each row by other states whose features are given
+        # row by row; rows that land in the same state keep the values of the last one
+        n = len(q_table)
+        states = self.states(np.asarray(features, dtype=np.float64).reshape(n, -1)).tolist()
+        return QTable.from_dict(dict(zip(states, q_table.values[:n])), q_table.n_actions)
+
+
+# Turret state of _precision.py, _targeting.py and _vector_env.py: the angle to the enemy in degrees,
+# in 10-degree bins that widen to [-10, 10) around zero, like the int(angle / 10) keys used before.
+# The outer edges at +-180 give the legacy (+-18,) keys, angles of exactly +-180, bins of their own
+# rather than sharing one with (+-17,).
+TURRET_DISCRETIZER = Discretizer([np.concatenate([np.arange(-180, 0, 10), np.arange(10, 190, 10)])])
+
+
+def legacy_turret_angles(states):
+    # An angle inside the bin of each (int(angle / 10),) state of older turret models
+    k = np.array([state[0] for state in states], dtype=np.float64)
+    return 10 * k + 5 * np.sign(k)
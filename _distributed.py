@@ -0,0 +1,144 @@
+import os
+import signal
+import argparse
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from _game import Game, Player, ALPHA, GAMMA, load_or_initialize_q_table, save_q_table
+from _seeding import resolve_seed, spawn_seeds, add_argument as add_seed_argument
+
+STEPS_PER_BATCH = 500  # Environment steps an actor runs before sending its transitions
+SYNC_EVERY = 20        # Transition batches the learner applies between policy snapshots
+
+
+class ActorPlayer(Player):
+    """Player that records its transitions for the learner instead of updating its own Q-table."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transitions = []
+
+    def update_q_table(self, state, action, reward, next_state):
+        self.transitions.append((state, action, reward, next_state))
+
+
+# Learner replies to each transition batch
+KEEP_POLICY = 'keep'
+STOP = 'stop'
+
+
+def actor(conn, q_table, steps_per_batch, seed):
+    # The learner coordinates shutdown, so Ctrl+C should only reach it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    game = Game(q_table=q_table, player_class=ActorPlayer, seed=seed)
+    while True:
+        for _ in range(steps_per_batch):
+            game.step()
+        # Every batch gets exactly one reply, so the two ends never block sending to each other.
+        # A learner shutting down may close its end instead of replying.
+        try:
+            conn.send(game.player.transitions)
+            reply = conn.recv()
+        except (EOFError, OSError):
+            reply = STOP
+        game.player.transitions = []
+        if reply == STOP:
+            conn.close()
+            return
+        if reply != KEEP_POLICY:
+            game.player.q_table = reply
+
+
+def apply_transitions(q_table, transitions):
+    states, actions, rewards, next_states = zip(*transitions)
+    rows = np.fromiter((q_table.row(state) for state in states), dtype=np.int64, count=len(states))
+    next_rows = np.fromiter((q_table.row(state) for state in next_states), dtype=np.int64, count=len(states))
+    q_table.update_batch(rows, np.array(actions), np.array(rewards), next_rows, ALPHA, GAMMA)
+
+
+def train(workers, max_steps, steps_per_batch=STEPS_PER_BATCH, sync_every=SYNC_EVERY, max_states=None, seed=None):
+    """Run `workers` headless actor processes and apply their transitions to one Q-table here.
+
+    Each actor's arena gets its own random stream spawned from `seed`. The order in which actor
+    batches arrive still depends on process scheduling, so runs are not replayed exactly.
+    """
+    seed = resolve_seed(seed)
+    print(f'Seed: {seed}')
+    q_table = load_or_initialize_q_table(max_states)
+    snapshot = q_table.copy()
+    snapshot_version = 0
+    actor_versions = {}
+    processes = []
+    for actor_seed in spawn_seeds(seed, workers):
+        parent_conn, child_conn = mp.Pipe()
+        process = mp.Process(target=actor, args=(child_conn, snapshot, steps_per_batch, actor_seed), daemon=True)
+        process.start()
+        child_conn.close()
+        actor_versions[parent_conn] = snapshot_version
+        processes.append(process)
+
+    steps = 0
+    batches = 0
+    try:
+        while actor_versions:
+            for conn in wait(list(actor_versions)):
+                transitions = conn.recv()
+                if steps >= max_steps:
+                    conn.send(STOP)
+                    del actor_versions[conn]
+                    continue
+                # Reply before learning so the actor can keep stepping meanwhile
+                if actor_versions[conn] < snapshot_version:
+                    conn.send(snapshot)
+                    actor_versions[conn] = snapshot_version
+                else:
+                    conn.send(KEEP_POLICY)
+
+                steps += len(transitions)
+                batches += 1
+                if transitions:
+                    apply_transitions(q_table, transitions)
+                    if max_states is not None:
+                        q_table.evict()
+                if batches % sync_every == 0:
+                    snapshot = q_table.copy()
+                    snapshot_version += 1
+                    print(f'Steps: {steps}  States: {len(q_table)}  Evicted: {q_table.evicted}')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Actors waiting on a reply would otherwise sit in recv until terminated
+        for conn in actor_versions:
+            try:
+                conn.send(STOP)
+            except OSError:
+                pass
+            conn.close()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        save_q_table(q_table, {'seed': seed})
+    return q_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the CQB Q-learning agent with parallel actor processes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of actor processes running headless games')
+    parser.add_argument('--steps', type=int, default=1000000,
+                        help='total environment steps to collect across all actors')
+    parser.add_argument('--steps-per-batch', type=int, default=STEPS_PER_BATCH,
+                        help='steps each actor runs before sending its transitions')
+    parser.add_argument('--sync-every', type=int, default=SYNC_EVERY,
+                        help='transition batches applied between policy snapshots sent to the actors')
+    parser.add_argument('--max-states', type=int, default=None,
+                        help='bound the Q-table to this many states, evicting the least recently used past it')
+    add_seed_argument(parser)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    train(args.workers, args.steps, args.steps_per_batch, args.sync_every, args.max_states, args.seed)
@@ -1,11 +1,28 @@
+import os
 import sys
 import math
-import random
-import pickle
+import argparse
+import functools
 
 import pygame
 import numpy as np
 
+from _clock import StepClock, ms_to_steps
+from _qtable import QTable, BoundedQTable, EVICT_LRU, EVICT_VISITS
+from _checkpoint import load_q_table, save_checkpoint
+from _discretize import Discretizer, uniform_edges
+from _actions import GAME_ACTIONS, GAME_DO_NOTHING
+from _metrics import MetricsLog
+from _qnet import QNetwork, save_network, load_network
+from _tiles import TileCoder, TileQFunction, save_tiles, load_tiles, N_TILINGS, TILE_RESOLUTION
+from _replay import ReplayBuffer
+from _policy import PolicyStore
+from _seeding import resolve_seed, spawn_seeds, add_argument as add_seed_argument
+from _profiling import NULL_PROFILER, add_arguments as add_profiling_arguments, from_args as profiler_from_args, cprofile
+from _raycast import OccupancyGrid
+from _spatial import WallIndex
+from _bullets import BulletPool
+
 # Constants
 SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
 WHITE = (255, 255, 255)
@@ -23,10 +40,15 @@ BULLET_SPEED = 20
 ENEMY_SIZE = 20
 VIEW_DISTANCE = 400
 VIEW_ANGLE = 60
-AI_MODEL_PATH = './models/game.pkl'
-AI_MODEL_SAVE_PATH = './models/game.pkl'
-COOLDOWN_PERIOD = 500
-KILL_TIMEOUT = 10000
+AI_MODEL_PATH = './models/game.qtc'
+AI_MODEL_SAVE_PATH = './models/game.qtc'
+LEGACY_MODEL_PATH = './models/game.pkl'  # Converted on first load when no checkpoint exists
+NETWORK_MODEL_PATH = './models/game_net.npz'
+TILES_MODEL_PATH = './models/game_tiles.npz'
+FPS = 30
+# Timers are counted in simulation steps so game logic does not depend on wall-clock speed
+COOLDOWN_PERIOD = ms_to_steps(500, FPS)
+KILL_TIMEOUT = ms_to_steps(10000, FPS)
 REWARD_STAND_STILL = -0.1
 REWARD_ENEMY_IN_VIEW = 0.1
 REWARD_KILL_ENEMY = 10
@@ -34,32 +56,72 @@ PENALTY_NO_KILL = -20
 REWARD_CLEAR_ENEMIES = 50
 ENEMY_SPEED = 2
 ENEMY_COUNT = 3
-FPS = 30
+N_ACTIONS = len(GAME_ACTIONS)
+OBSERVATION_SIZE = 7
+STATE_RESOLUTION = 0.01  # Bin width of the normalized position, angle and distance features
+MAX_WALL_COUNT = 63      # Wall counts above this share the last bin
 EPSILON = 0.1  # Exploration rate
 ALPHA = 0.1    # Learning rate
 GAMMA = 0.95   # Discount factor
-
-# Initialize Pygame
-pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("CQB AI Game with Q-Learning")
-font = pygame.font.Font(None, FONT_SIZE)
-clock = pygame.time.Clock()
-
-def load_or_initialize_q_table():
-    try:
-        with open(AI_MODEL_PATH, 'rb') as f:
-            q_table = pickle.load(f)
-    except FileNotFoundError:
-        q_table = {}
+REPLAY_BUFFER_SIZE = 50000  # Transitions kept by each network player
+BATCH_SIZE = 32             # Transitions per network training step
+
+# State ids of the Player.features vectors: x, y, angle, distance and angle to the closest enemy,
+# then the wall and enemy counts
+STATE_DISCRETIZER = Discretizer([
+    uniform_edges(0, 1, STATE_RESOLUTION),
+    uniform_edges(0, 1, STATE_RESOLUTION),
+    uniform_edges(0, 1, STATE_RESOLUTION),
+    uniform_edges(0, math.hypot(SCREEN_WIDTH, SCREEN_HEIGHT) / VIEW_DISTANCE, STATE_RESOLUTION),
+    uniform_edges(0, 1, STATE_RESOLUTION),
+    uniform_edges(0, MAX_WALL_COUNT, 1),
+    uniform_edges(0, ENEMY_COUNT, 1),
+])
+
+def load_or_initialize_q_table(max_states=None, evict=EVICT_LRU):
+    # With max_states the table is bounded, evicting states by `evict` once it holds more
+    q_table = load_q_table(AI_MODEL_PATH, LEGACY_MODEL_PATH, N_ACTIONS)
+    if len(q_table) and isinstance(next(q_table.all_states()), tuple):
+        # Older models keyed states by the tuple of rounded features, which bin to the same cells
+        q_table = STATE_DISCRETIZER.rekey(q_table, list(q_table.all_states()))
+    if max_states is not None:
+        q_table = BoundedQTable.from_table(q_table, max_states, evict)
     return q_table
 
-def save_q_table(q_table):
-    with open(AI_MODEL_SAVE_PATH, 'wb') as f:
-        pickle.dump(q_table, f)
+def save_q_table(q_table, metadata=None):
+    save_checkpoint(AI_MODEL_SAVE_PATH, q_table, {'script': 'game', **(metadata or {})})
+
+# Range of each Player.features value, for the network input scale and the tile coder
+OBSERVATION_LOW = np.zeros(OBSERVATION_SIZE)
+OBSERVATION_HIGH = np.array([1, 1, 1, math.hypot(SCREEN_WIDTH, SCREEN_HEIGHT) / VIEW_DISTANCE, 1,
+                             MAX_WALL_COUNT, ENEMY_COUNT], dtype=np.float64)
+
+def load_or_initialize_network(rng=None):
+    # `rng` draws the initial weights of a new network
+    if os.path.exists(NETWORK_MODEL_PATH):
+        return load_network(NETWORK_MODEL_PATH)
+    # Scale the wall and enemy counts and the distance, which can exceed 1, to roughly [0, 1]
+    return QNetwork(OBSERVATION_SIZE, N_ACTIONS, input_scale=1 / OBSERVATION_HIGH, rng=rng)
+
+def load_or_initialize_tiles(n_tilings=N_TILINGS, resolution=TILE_RESOLUTION):
+    if os.path.exists(TILES_MODEL_PATH):
+        q_function = load_tiles(TILES_MODEL_PATH)
+        saved = (q_function.coder.n_tilings, q_function.coder.resolution)
+        if saved != (n_tilings, resolution):
+            raise ValueError(f'{TILES_MODEL_PATH} was trained with {saved[0]} tilings at resolution {saved[1]}; '
+                             f'pass those or move the file away to start over')
+        return q_function
+    return TileQFunction(TileCoder(OBSERVATION_LOW, OBSERVATION_HIGH, n_tilings, resolution), N_ACTIONS)
+
+# Players built without a table all share this one instead of each loading the model
+GAME_POLICY = PolicyStore(load_or_initialize_q_table)
+NETWORK_POLICY = PolicyStore(load_or_initialize_network)
+TILES_POLICY = PolicyStore(load_or_initialize_tiles)
 
 class Player:
-    def __init__(self, x, y, color, controls, is_ai=False):
+    policy = GAME_POLICY
+
+    def __init__(self, x, y, color, controls, clock, is_ai=False, q_table=None, rng=None):
         self.rect = pygame.Rect(x, y, PLAYER_SIZE, PLAYER_SIZE)
         self.color = color
         self.angle = 0
@@ -68,14 +130,35 @@ class Player:
         self.view_distance = VIEW_DISTANCE
         self.view_angle = VIEW_ANGLE
         self.controls = controls
-        self.bullets = []
+        self.bullets = BulletPool(BULLET_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT, BULLET_COLOR)
         self.is_ai = is_ai
+        self.clock = clock
         self.reward = 0
         self.last_shot_time = 0
-        self.last_kill_time = pygame.time.get_ticks()
+        self.last_kill_time = clock.ticks
         self.previous_state = None
         self.previous_action = None
-        self.q_table = load_or_initialize_q_table()
+        self.view_surface = None
+        self.rng = np.random.default_rng() if rng is None else rng  # Exploration and tie-breaking
+        self.shared_policy = q_table is None
+        self.q_table = self.acquire_policy() if self.shared_policy else q_table
+        self.profiler = NULL_PROFILER
+
+    def acquire_policy(self):
+        return self.policy.acquire()
+
+    def release(self):
+        # Hand a table taken from the policy store back; tables passed in by the caller stay the caller's
+        if self.shared_policy:
+            self.shared_policy = False
+            self.policy.release()
+
+    def save_policy(self, metadata=None):
+        save_q_table(self.q_table, metadata)
+
+    def stats(self):
+        # Values of the learned policy logged with the training metrics
+        return {'q_table_states': len(self.q_table), 'evicted_states': self.q_table.evicted}
 
     def move(self, walls, enemies):
         if self.is_ai:
@@ -99,19 +182,29 @@ class Player:
             self.angle = (self.angle + self.rotation_speed) % 360
 
     def ai_move(self, walls, enemies):
-        state = self.get_state(walls, enemies)
-        action = self.choose_action(state)
-        self.perform_action(action, walls)
-
-        reward = self.calculate_reward(enemies)
-        next_state = self.get_state(walls, enemies)
-        self.update_q_table(state, action, reward, next_state)
+        profiler = self.profiler
+        with profiler.phase('get_state'):
+            state = self.get_state(walls, enemies)
+        with profiler.phase('choose_action'):
+            action = self.choose_action(state)
+        with profiler.phase('act'):
+            reward = self.act(action, walls, enemies)
+        with profiler.phase('get_state'):
+            next_state = self.get_state(walls, enemies)
+        with profiler.phase('update_q_table'):
+            self.update_q_table(state, action, reward, next_state)
 
         self.previous_state = state
+
+    def act(self, action, walls, enemies):
+        # Environment side of an AI move: perform the action and return its shaping reward
+        self.perform_action(action, walls)
+        reward = self.calculate_reward(enemies)
         self.previous_action = action
+        return reward
 
     def handle_collisions(self, dx, dy, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if dx > 0:
                     self.rect.right = wall.left
@@ -122,36 +215,39 @@ class Player:
                 if dy < 0:
                     self.rect.top = wall.bottom
 
-    def get_state(self, walls, enemies):
-        closest_enemy = min(enemies, key=lambda enemy: self.distance_to(enemy))
-        distance_to_enemy = self.distance_to(closest_enemy)
+    def features(self, walls, enemies):
+        distance_to_enemy, closest_enemy = min(((self.distance_to(enemy), enemy) for enemy in enemies),
+                                               key=lambda pair: pair[0])
         angle_to_enemy = self.angle_to_enemy(closest_enemy)
-        state = (
-            round(self.rect.centerx / SCREEN_WIDTH, 2),
-            round(self.rect.centery / SCREEN_HEIGHT, 2),
-            round(self.angle / 360, 2),
-            round(distance_to_enemy / self.view_distance, 2),
-            round(angle_to_enemy / 360, 2),
+        return (
+            self.rect.centerx / SCREEN_WIDTH,
+            self.rect.centery / SCREEN_HEIGHT,
+            self.angle / 360,
+            distance_to_enemy / self.view_distance,
+            angle_to_enemy / 360,
             len(walls),
             len(enemies)
         )
-        return state
+
+    def get_state(self, walls, enemies):
+        return STATE_DISCRETIZER.state(self.features(walls, enemies))
+
+    def get_observation(self, walls, enemies, out=None):
+        # Unrounded features as a contiguous float32 vector, written into `out` when given
+        if out is None:
+            out = np.empty(OBSERVATION_SIZE, dtype=np.float32)
+        out[:] = self.features(walls, enemies)
+        return out
 
     def choose_action(self, state):
-        if random.uniform(0, 1) < EPSILON:
-            action = random.choice(list(range(len(self.action_space()))))
+        if self.rng.random() < EPSILON:
+            action = int(self.rng.integers(N_ACTIONS))
         else:
-            q_values = self.q_table.get(state, [0] * len(self.action_space()))
-            max_q = max(q_values)
-            actions_with_max_q = [i for i, q in enumerate(q_values) if q == max_q]
-            action = random.choice(actions_with_max_q)
+            action = self.q_table.best_action(state, self.rng)
         return action
 
     def perform_action(self, action_index, walls):
-        action = self.action_space()[action_index]
-        move = action['move']
-        rotate = action['rotate']
-        shoot = action['shoot']
+        move, rotate, shoot = GAME_ACTIONS[action_index].tolist()
 
         self.angle = (self.angle + rotate * self.rotation_speed) % 360
         dx = self.speed * move * math.cos(math.radians(self.angle))
@@ -170,32 +266,13 @@ class Player:
         for enemy in enemies:
             if self.is_enemy_in_view(enemy):
                 reward += REWARD_ENEMY_IN_VIEW
-        if self.previous_state and self.previous_action is not None:
-            if self.previous_action == 0:  # If doing nothing
+        if self.previous_action is not None:
+            if self.previous_action == GAME_DO_NOTHING:
                 reward += REWARD_STAND_STILL
         return reward
 
     def update_q_table(self, state, action, reward, next_state):
-        q_values = self.q_table.get(state, [0] * len(self.action_space()))
-        next_q_values = self.q_table.get(next_state, [0] * len(self.action_space()))
-        max_next_q = max(next_q_values)
-
-        q_values[action] = q_values[action] + ALPHA * (reward + GAMMA * max_next_q - q_values[action])
-        self.q_table[state] = q_values
-
-    def action_space(self):
-        return [
-            {'move': 0, 'rotate': 0, 'shoot': False},  # Do nothing
-            {'move': 1, 'rotate': 0, 'shoot': False},  # Move forward
-            {'move': -1, 'rotate': 0, 'shoot': False},  # Move backward
-            {'move': 0, 'rotate': -1, 'shoot': False},  # Rotate left
-            {'move': 0, 'rotate': 1, 'shoot': False},  # Rotate right
-            {'move': 0, 'rotate': 0, 'shoot': True},  # Shoot
-            {'move': 1, 'rotate': -1, 'shoot': False},  # Move forward and rotate left
-            {'move': 1, 'rotate': 1, 'shoot': False},  # Move forward and rotate right
-            {'move': -1, 'rotate': -1, 'shoot': False},  # Move backward and rotate left
-            {'move': -1, 'rotate': 1, 'shoot': False},  # Move backward and rotate right
-        ]
+        self.q_table.update(state, action, reward, next_state, ALPHA, GAMMA)
 
     def angle_to_enemy(self, enemy):
         dx = enemy.rect.centerx - self.rect.centerx
@@ -214,100 +291,138 @@ class Player:
         return math.hypot(dx, dy)
 
     def shoot(self):
-        current_time = pygame.time.get_ticks()
+        current_time = self.clock.ticks
         if current_time - self.last_shot_time > COOLDOWN_PERIOD:
             angle_rad = math.radians(self.angle)
             bullet_dx = BULLET_SPEED * math.cos(angle_rad)
             bullet_dy = BULLET_SPEED * math.sin(angle_rad)
-            bullet = Bullet(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy, BULLET_COLOR)
-            self.bullets.append(bullet)
+            self.bullets.spawn(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy)
             self.last_shot_time = current_time
 
     def update_bullets(self, walls, enemies, score):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            if bullet.is_off_screen() or bullet.collides_with_walls(walls):
-                self.bullets.remove(bullet)
-            else:
-                for enemy in enemies[:]:
-                    if bullet.rect.colliderect(enemy.rect):
-                        enemies.remove(enemy)
-                        self.bullets.remove(bullet)
-                        score += 1
-                        if self.is_ai:
-                            self.reward += REWARD_KILL_ENEMY
-                            self.last_kill_time = pygame.time.get_ticks()
-                        break
+        if not self.bullets:
+            return score
+        _, _, hit_enemy = self.bullets.step([enemy.rect for enemy in enemies], walls)
+        # Remove from the back so the remaining indices stay valid
+        for i in sorted({i for i in hit_enemy.tolist() if i >= 0}, reverse=True):
+            del enemies[i]
+            score += 1
+            if self.is_ai:
+                self.reward += REWARD_KILL_ENEMY
+                self.last_kill_time = self.clock.ticks
         return score
 
     def draw(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
 
-    def draw_view(self, surface, walls):
+    def view_rays(self, occupancy):
+        # Ray angles across the field of view and the distance each travels before hitting a wall
         start_angle = self.angle - self.view_angle / 2
         end_angle = self.angle + self.view_angle / 2
-        s = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
-        for i in range(int(start_angle), int(end_angle) + 1, 2):
-            angle_rad = math.radians(i)
-            for distance in range(0, self.view_distance, 5):
-                x = self.rect.centerx + distance * math.cos(angle_rad)
-                y = self.rect.centery + distance * math.sin(angle_rad)
-                if not (0 <= x < SCREEN_WIDTH and 0 <= y < SCREEN_HEIGHT):
-                    break
-                if any(wall.collidepoint(x, y) for wall in walls):
-                    break
-                s.set_at((int(x), int(y)), self.color + (50,))
-        surface.blit(s, (0, 0))
+        angles = np.arange(int(start_angle), int(end_angle) + 1, 2)
+        return angles, occupancy.cast(self.rect.centerx, self.rect.centery, angles, self.view_distance)
+
+    def draw_view(self, surface, occupancy):
+        angles, distances = self.view_rays(occupancy)
+        angles_rad = np.radians(angles)
+        xs = self.rect.centerx + distances * np.cos(angles_rad)
+        ys = self.rect.centery + distances * np.sin(angles_rad)
+        if self.view_surface is None:
+            self.view_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
+        self.view_surface.fill((0, 0, 0, 0))
+        points = [self.rect.center] + list(zip(xs.tolist(), ys.tolist()))
+        pygame.draw.polygon(self.view_surface, self.color + (50,), points)
+        surface.blit(self.view_surface, (0, 0))
 
     def draw_bullets(self, surface):
-        for bullet in self.bullets:
-            bullet.draw(surface)
-
-class Bullet:
-    def __init__(self, x, y, dx, dy, color):
-        self.rect = pygame.Rect(x, y, BULLET_SIZE, BULLET_SIZE)
-        self.dx = dx
-        self.dy = dy
-        self.color = color
+        self.bullets.draw(surface)
 
-    def move(self):
-        self.rect.x += round(self.dx)
-        self.rect.y += round(self.dy)
+class NetworkPlayer(Player):
+    """AI player whose Q-function is a QNetwork over the unrounded observations instead of a Q-table.
 
-    def is_off_screen(self):
-        return not (0 <= self.rect.x <= SCREEN_WIDTH and 0 <= self.rect.y <= SCREEN_HEIGHT)
+    Its q_table holds the network. Every step appends the transition to a replay buffer and trains
+    the network on one sampled minibatch, so memory stays constant however many states are visited.
+    """
+    policy = NETWORK_POLICY
 
-    def collides_with_walls(self, walls):
-        return any(self.rect.colliderect(wall) for wall in walls)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replay_buffer = ReplayBuffer(REPLAY_BUFFER_SIZE, (OBSERVATION_SIZE,), np.float32, self.rng)
+        self.loss = None
 
-    def draw(self, surface):
-        pygame.draw.rect(surface, self.color, self.rect)
+    def acquire_policy(self):
+        # A new network draws its initial weights from the player's seeded stream
+        return self.policy.acquire(self.rng)
+
+    def get_state(self, walls, enemies):
+        return self.get_observation(walls, enemies)
+
+    def update_q_table(self, state, action, reward, next_state):
+        self.replay_buffer.append(state, action, reward, next_state)
+        if len(self.replay_buffer) >= BATCH_SIZE:
+            self.loss = self.q_table.train_batch(*self.replay_buffer.sample(BATCH_SIZE), GAMMA)
+
+    def save_policy(self, metadata=None):
+        save_network(NETWORK_MODEL_PATH, self.q_table, metadata)
+
+    def stats(self):
+        return {'network_updates': self.q_table.updates, 'loss': self.loss}
+
+class TilePlayer(Player):
+    """AI player learning a linear Q-function over hashed tile codings of the unrounded observations.
+
+    Its q_table holds the TileQFunction, whose weight table has a fixed size, and it is updated
+    online every step like the Q-table.
+    """
+    policy = TILES_POLICY
+
+    def get_state(self, walls, enemies):
+        return self.get_observation(walls, enemies)
+
+    def save_policy(self, metadata=None):
+        save_tiles(TILES_MODEL_PATH, self.q_table, metadata)
+
+    def stats(self):
+        return {'tile_updates': self.q_table.updates}
+
+PLAYER_CLASSES = {'table': Player, 'network': NetworkPlayer, 'tiles': TilePlayer}
+# Each brain keeps its own metrics log, named like its model, so runs of different brains don't interleave
+METRICS_FILES = {'table': './logs/game.jsonl', 'network': './logs/game_net.jsonl', 'tiles': './logs/game_tiles.jsonl'}
+
+# Steps of a random enemy move: left, right, up, down
+ENEMY_MOVES = ((-1, 0), (1, 0), (0, -1), (0, 1))
+MOVES_PER_DRAW = int(63 // math.log2(len(ENEMY_MOVES)))  # Enemy moves packed into one int64 draw
+
+def random_moves(rng, count):
+    # `count` uniform ENEMY_MOVES indices from scalar draws, which cost far less than one size=count draw
+    moves = []
+    while len(moves) < count:
+        n = min(count - len(moves), MOVES_PER_DRAW)
+        code = int(rng.integers(len(ENEMY_MOVES) ** n))
+        for _ in range(n):
+            code, move = divmod(code, len(ENEMY_MOVES))
+            moves.append(move)
+    return moves
 
 class Enemy:
-    def __init__(self, x, y, color):
+    def __init__(self, x, y, color, angle=0):
         self.rect = pygame.Rect(x, y, ENEMY_SIZE, ENEMY_SIZE)
         self.color = color
-        self.angle = random.randint(0, 360)
+        self.angle = angle
         self.speed = ENEMY_SPEED
 
-    def move(self, walls):
-        direction = random.choice(['left', 'right', 'up', 'down'])
-        dx = dy = 0
-        if direction == 'left':
-            dx = -self.speed
-        elif direction == 'right':
-            dx = self.speed
-        elif direction == 'up':
-            dy = -self.speed
-        elif direction == 'down':
-            dy = self.speed
+    def move(self, walls, direction):
+        # `direction` indexes ENEMY_MOVES
+        dx, dy = ENEMY_MOVES[direction]
+        dx *= self.speed
+        dy *= self.speed
         self.rect.x += dx
         self.handle_collisions(dx, 0, walls)
         self.rect.y += dy
         self.handle_collisions(0, dy, walls)
 
     def handle_collisions(self, dx, dy, walls):
-        for wall in walls:
+        for wall in walls.query(self.rect):
             if self.rect.colliderect(wall):
                 if dx > 0:
                     self.rect.right = wall.left
@@ -346,73 +461,265 @@ def create_walls_and_doors():
                 break
     return walls, doors
 
-def create_enemies():
-    return [Enemy(random.randint(100, SCREEN_WIDTH - 100), random.randint(100, SCREEN_HEIGHT - 100), ENEMY_COLOR)
-            for _ in range(ENEMY_COUNT)]
-
-def main():
-    walls, doors = create_walls_and_doors()
-    player_controls = {
-        'left': pygame.K_a,
-        'right': pygame.K_d,
-        'up': pygame.K_w,
-        'down': pygame.K_s,
-        'rotate_left': pygame.K_q,
-        'rotate_right': pygame.K_e,
-        'shoot': pygame.K_SPACE
-    }
-    player = Player(100, 100, PLAYER_COLOR, player_controls, is_ai=True)
-    enemies = create_enemies()
-    score = 0
-
-    running = True
-    while running:
-        current_time = pygame.time.get_ticks()
-        if current_time - player.last_kill_time > KILL_TIMEOUT and player.reward >= 0:
-            player.reward += PENALTY_NO_KILL
-            player.rect.topleft = (100, 100)
-            player.angle = 0
-            player.reward = 0
-            player.bullets.clear()
-            player.last_shot_time = 0
-            player.previous_state = None
-            player.previous_action = None
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                save_q_table(player.q_table)
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == player_controls['shoot']:
-                    keys = pygame.key.get_pressed()
-                    if not any(keys[player_controls[dir]] for dir in ['left', 'right', 'up', 'down']):
-                        player.shoot()
-
-        player.move(walls, enemies)
-        score = player.update_bullets(walls, enemies, score)
-
-        if not enemies:
-            player.reward += REWARD_CLEAR_ENEMIES
-            enemies = create_enemies()
+class GameMap:
+    """Static geometry of a map: the wall index, the doors and the occupancy grid for view rays."""
+    def __init__(self, walls, doors):
+        self.walls = WallIndex(walls)
+        self.doors = doors
+        self.occupancy = OccupancyGrid(self.walls, SCREEN_WIDTH, SCREEN_HEIGHT)
+
+@functools.lru_cache(maxsize=None)
+def default_map():
+    # Built once per process; nothing mutates a map, so every arena can share it
+    return GameMap(*create_walls_and_doors())
+
+def create_enemies(rng, count=ENEMY_COUNT):
+    xs = rng.integers(100, SCREEN_WIDTH - 100, size=count, endpoint=True).tolist()
+    ys = rng.integers(100, SCREEN_HEIGHT - 100, size=count, endpoint=True).tolist()
+    angles = rng.integers(0, 360, size=count, endpoint=True).tolist()
+    return [Enemy(x, y, ENEMY_COLOR, angle) for x, y, angle in zip(xs, ys, angles)]
+
+PLAYER_CONTROLS = {
+    'left': pygame.K_a,
+    'right': pygame.K_d,
+    'up': pygame.K_w,
+    'down': pygame.K_s,
+    'rotate_left': pygame.K_q,
+    'rotate_right': pygame.K_e,
+    'shoot': pygame.K_SPACE
+}
+
+class Game:
+    """One CQB arena: walls, enemies, the AI player and the step clock that drives its timers.
+
+    Every random draw of the arena and its player comes from one generator seeded with `seed`, so equal
+    seeds replay the same run step for step. Arenas share `game_map`, the default map unless given.
+    """
+    def __init__(self, q_table=None, player_class=Player, enemy_count=ENEMY_COUNT, profiler=NULL_PROFILER,
+                 seed=None, game_map=None):
+        self.rng = np.random.default_rng(seed)
+        self.clock = StepClock()
+        self.enemy_count = enemy_count
+        self.profiler = profiler
+        game_map = default_map() if game_map is None else game_map
+        self.walls = game_map.walls
+        self.doors = game_map.doors
+        self.occupancy = game_map.occupancy
+        self.player = player_class(100, 100, PLAYER_COLOR, PLAYER_CONTROLS, self.clock, is_ai=True, q_table=q_table,
+                                   rng=self.rng)
+        self.player.profiler = profiler
+        self.enemies = create_enemies(self.rng, enemy_count)
+        self.score = 0
+
+    def timed_out(self):
+        player = self.player
+        return self.clock.ticks - player.last_kill_time > KILL_TIMEOUT and player.reward >= 0
+
+    def reset_player(self):
+        player = self.player
+        player.reward += PENALTY_NO_KILL
+        player.rect.topleft = (100, 100)
+        player.angle = 0
+        player.reward = 0
+        player.bullets.clear()
+        player.last_shot_time = 0
+        player.last_kill_time = self.clock.ticks
+        player.previous_state = None
+        player.previous_action = None
+
+    def step(self, action=None):
+        """Advance the arena by one step and return the reward the player earned in it.
+
+        Without an action the player moves on its own (choosing and learning, or from the keyboard).
+        """
+        player = self.player
+        if self.timed_out():
+            self.reset_player()
 
-        for enemy in enemies:
-            enemy.move(walls)
+        reward = 0
+        if action is None:
+            player.move(self.walls, self.enemies)
+        else:
+            reward = player.act(action, self.walls, self.enemies)
+        reward_before = player.reward
+        with self.profiler.phase('update_bullets'):
+            self.score = player.update_bullets(self.walls, self.enemies, self.score)
 
+        if not self.enemies:
+            player.reward += REWARD_CLEAR_ENEMIES
+            self.enemies = create_enemies(self.rng, self.enemy_count)
+        reward += player.reward - reward_before
+
+        with self.profiler.phase('move_enemies'):
+            directions = random_moves(self.rng, len(self.enemies))
+            for enemy, direction in zip(self.enemies, directions):
+                enemy.move(self.walls, direction)
+        self.clock.tick()
+        return reward
+
+class GameEnv:
+    """Batch of independent arenas behind a reset()/step(actions) interface.
+
+    The caller picks every action; observations are float32 arrays of shape (n_envs, OBSERVATION_SIZE).
+    An arena whose player times out without a kill reports done and is reset in the same step.
+    Each arena gets its own random stream spawned from `seed`.
+    """
+    observation_size = OBSERVATION_SIZE
+    n_actions = N_ACTIONS
+
+    def __init__(self, n_envs=1, seed=None):
+        self.n_envs = n_envs
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.games = []
+        self.observations = np.zeros((n_envs, OBSERVATION_SIZE), dtype=np.float32)
+        self.rewards = np.zeros(n_envs, dtype=np.float32)
+        self.dones = np.zeros(n_envs, dtype=bool)
+
+    def _observe(self):
+        for game, out in zip(self.games, self.observations):
+            game.player.get_observation(game.walls, game.enemies, out)
+        return self.observations.copy()
+
+    def reset(self):
+        # Arenas never learn here, so they share one empty table instead of loading the model
+        q_table = QTable(N_ACTIONS)
+        self.games = [Game(q_table=q_table, seed=seed) for seed in self.seed_sequence.spawn(self.n_envs)]
+        return self._observe()
+
+    def step(self, actions):
+        for i, (game, action) in enumerate(zip(self.games, actions)):
+            self.rewards[i] = game.step(int(action))
+            self.dones[i] = game.timed_out()
+            if self.dones[i]:
+                self.rewards[i] += PENALTY_NO_KILL
+                game.reset_player()
+        return self._observe(), self.rewards.copy(), self.dones.copy()
+
+class Renderer:
+    """Draws the game into a window every `every` steps; the display is only opened here."""
+    def __init__(self, every=1):
+        pygame.init()
+        self.every = every
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("CQB AI Game with Q-Learning")
+        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.clock = pygame.time.Clock()
+        self.profiler = NULL_PROFILER
+
+    def draw(self, game):
+        screen = self.screen
+        player = game.player
         screen.fill(FLOOR_COLOR)
-        for wall in walls:
+        for wall in game.walls:
             pygame.draw.rect(screen, WALL_COLOR, wall)
-        for door in doors:
+        for door in game.doors:
             pygame.draw.rect(screen, FLOOR_COLOR, door)
-        player.draw_view(screen, walls)
+        with self.profiler.phase('draw_view'):
+            player.draw_view(screen, game.occupancy)
         player.draw(screen)
         player.draw_bullets(screen)
-        for enemy in enemies:
+        for enemy in game.enemies:
             enemy.draw(screen)
-        score_text = font.render(f"Score: {score}  Reward: {player.reward}", True, WHITE)
+        score_text = self.font.render(f"Score: {game.score}  Reward: {player.reward}", True, WHITE)
         screen.blit(score_text, (10, 10))
-        pygame.display.flip()
-        clock.tick(FPS)
+        with self.profiler.phase('display_flip'):
+            pygame.display.flip()
+        # Only cap the frame rate when every step is shown, otherwise train at full speed
+        if self.every == 1:
+            self.clock.tick(FPS)
+
+def quit_game(player, metadata=None):
+    player.save_policy(metadata)
+    player.release()
+    pygame.quit()
+    sys.exit()
+
+def main(headless=False, render_every=1, max_steps=None, profiler=NULL_PROFILER, metrics_path=None,
+         brain='table', max_states=None, evict=EVICT_LRU, n_tilings=N_TILINGS, tile_resolution=TILE_RESOLUTION,
+         seed=None):
+    seed = resolve_seed(seed)
+    print(f'Seed: {seed}')
+    game_seed, policy_seed = spawn_seeds(seed, 2)
+    renderer = None if headless else Renderer(render_every)
+    q_table = None
+    if brain == 'table' and max_states is not None:
+        q_table = load_or_initialize_q_table(max_states, evict)
+    elif brain == 'network':
+        q_table = load_or_initialize_network(np.random.default_rng(policy_seed))
+    elif brain == 'tiles':
+        q_table = load_or_initialize_tiles(n_tilings, tile_resolution)
+    game = Game(q_table=q_table, player_class=PLAYER_CLASSES[brain], profiler=profiler, seed=game_seed)
+    player = game.player
+    if renderer is not None:
+        renderer.profiler = profiler
+    for name in player.stats():
+        profiler.watch(name, lambda name=name: player.stats()[name])
+    profiler.watch('score', lambda: game.score)
+    metrics = MetricsLog(METRICS_FILES[brain] if metrics_path is None else metrics_path)
+    episode_start = game.clock.ticks
+
+    try:
+        while max_steps is None or game.clock.ticks < max_steps:
+            render = renderer is not None and game.clock.ticks % renderer.every == 0
+            if render:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        quit_game(player, {'seed': seed})
+                    elif event.type == pygame.KEYDOWN:
+                        if event.key == PLAYER_CONTROLS['shoot']:
+                            keys = pygame.key.get_pressed()
+                            if not any(keys[PLAYER_CONTROLS[dir]] for dir in ['left', 'right', 'up', 'down']):
+                                player.shoot()
+
+            if game.timed_out():
+                # The player is about to be reset, which ends its episode
+                metrics.log(steps=game.clock.ticks, episode_steps=game.clock.ticks - episode_start,
+                            best_reward=player.reward, mean_reward=player.reward, epsilon=EPSILON,
+                            score=game.score, **player.stats())
+                episode_start = game.clock.ticks
+            game.step()
+
+            if render:
+                with profiler.phase('render'):
+                    renderer.draw(game)
+            profiler.step()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiler.close()
+        metrics.close()
+    quit_game(player, {'seed': seed})
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CQB AI Game with Q-Learning")
+    parser.add_argument('--headless', action='store_true',
+                        help='train without a window, rendering or frame cap')
+    parser.add_argument('--render-every', type=int, default=1,
+                        help='draw one frame every N steps; the FPS cap only applies when N is 1')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='stop after this many steps and save the model')
+    parser.add_argument('--brain', choices=sorted(PLAYER_CLASSES), default='table',
+                        help='learn a Q-table over rounded states, or a NumPy Q-network or tile-coded linear '
+                             'Q-function over raw observations')
+    parser.add_argument('--max-states', type=int, default=None,
+                        help='bound the Q-table to this many states, evicting the least useful ones past it')
+    parser.add_argument('--evict', choices=[EVICT_LRU, EVICT_VISITS], default=EVICT_LRU,
+                        help='evict the least recently updated states (lru) or the least visited ones (visits)')
+    parser.add_argument('--tilings', type=int, default=N_TILINGS,
+                        help='overlapping tilings of the tiles brain')
+    parser.add_argument('--tile-resolution', type=int, default=TILE_RESOLUTION,
+                        help='tiles across each feature in one tiling of the tiles brain')
+    add_seed_argument(parser)
+    parser.add_argument('--metrics', default=None,
+                        help='append one JSON line of episode metrics per game to this file '
+                             '(default: logs/game.jsonl, logs/game_net.jsonl or logs/game_tiles.jsonl by --brain)')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    with cprofile(args.profile):
+        main(headless=args.headless, render_every=args.render_every, max_steps=args.steps,
+             profiler=profiler_from_args(args), metrics_path=args.metrics, brain=args.brain,
+             max_states=args.max_states, evict=args.evict, n_tilings=args.tilings,
+             tile_resolution=args.tile_resolution, seed=args.seed)
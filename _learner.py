@@ -0,0 +1,35 @@
+from _replay import ReplayBuffer
+
+
+class Learner:
+    """Central learner owning the replay buffer and Q-table shared by all actors.
+
+    Actors only hand over transitions; the learner runs `replay_ratio` batched updates per
+    environment step, however many actors produced data during that step.
+    """
+    def __init__(self, q_table, buffer_size, batch_size, replay_ratio, alpha, gamma, rng=None):
+        self.q_table = q_table
+        self.replay_buffer = ReplayBuffer(buffer_size, rng=rng)
+        self.batch_size = batch_size
+        self.replay_ratio = replay_ratio
+        self.alpha = alpha
+        self.gamma = gamma
+        self.updates = 0
+        self._pending_updates = 0.0  # Carries fractional replay ratios over to later steps
+
+    def observe(self, state, action, reward, next_state):
+        self.replay_buffer.append(state, action, reward, next_state)
+
+    def observe_batch(self, states, actions, rewards, next_states):
+        # One transition per arena of a VectorEnv step
+        self.replay_buffer.extend(states, actions, rewards, next_states)
+
+    def step(self):
+        if len(self.replay_buffer) < self.batch_size:
+            return
+        self._pending_updates += self.replay_ratio
+        while self._pending_updates >= 1:
+            states, actions, rewards, next_states = self.replay_buffer.sample(self.batch_size)
+            self.q_table.update_batch(states, actions, rewards, next_states, self.alpha, self.gamma)
+            self._pending_updates -= 1
+            self.updates += 1
@@ -0,0 +1,45 @@
+import os
+import json
+import time
+
+
+class MetricsLog:
+    """Appends one JSON line per finished episode to `path`, flushed as it is written.
+
+    Episode numbers continue from the last line already in the file, so resumed runs extend the same log.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.episode = last_episode(path)
+        self.file = open(path, 'a')
+        self.start_time = time.perf_counter()
+
+    def log(self, **fields):
+        self.episode += 1
+        record = {'episode': self.episode, **fields, 'wall_time': round(time.perf_counter() - self.start_time, 3)}
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def last_episode(path):
+    episode = 0
+    if os.path.exists(path):
+        for record in read_metrics(path):
+            episode = record.get('episode', episode)
+    return episode
+
+
+def read_metrics(path):
+    # Records of a metrics log in order; a line cut off by a crash mid-write is skipped
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
@@ -0,0 +1,61 @@
+import argparse
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from _metrics import read_metrics
+
+OUTPUT_FILE = 'learning_progress.png'
+
+LABELS = {
+    'episode': 'Game Number',
+    'steps': 'Steps',
+    'wall_time': 'Wall Time (s)',
+    'best_reward': 'Best Reward',
+    'mean_reward': 'Mean Reward',
+    'epsilon': 'Exploration Rate',
+}
+
+
+def moving_average(values, window):
+    if window <= 1 or len(values) < window:
+        return values
+    return np.convolve(values, np.ones(window) / window, mode='valid')
+
+
+def plot_metrics(paths, x='episode', ys=('best_reward',), smooth=1, out=OUTPUT_FILE):
+    for path in paths:
+        records = [record for record in read_metrics(path) if x in record]
+        for y in ys:
+            points = [(record[x], record[y]) for record in records if record.get(y) is not None]
+            if not points:
+                continue
+            xs, values = np.array(points, dtype=np.float64).T
+            values = moving_average(values, smooth)
+            label = f'{path}: {LABELS.get(y, y)}' if len(paths) > 1 else LABELS.get(y, y)
+            plt.plot(xs[len(xs) - len(values):], values, label=label)
+    plt.xlabel(LABELS.get(x, x))
+    plt.ylabel(LABELS.get(ys[0], ys[0]) if len(ys) == 1 else 'Value')
+    plt.title('AI Learning Progress Over Time')
+    if len(paths) > 1 or len(ys) > 1:
+        plt.legend()
+    plt.savefig(out)
+    plt.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot training metrics logs written by the training scripts")
+    parser.add_argument('paths', nargs='+', help='metrics .jsonl logs, e.g. logs/precision.jsonl')
+    parser.add_argument('--x', default='episode', help='field for the x axis (default: episode)')
+    parser.add_argument('--y', nargs='+', default=['best_reward'], help='fields to plot (default: best_reward)')
+    parser.add_argument('--smooth', type=int, default=1, help='moving-average window in episodes')
+    parser.add_argument('--out', default=OUTPUT_FILE, help=f'image to write (default: {OUTPUT_FILE})')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    plot_metrics(args.paths, args.x, args.y, args.smooth, args.out)
+    print(f'Wrote {args.out}')
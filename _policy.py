@@ -0,0 +1,25 @@
+class PolicyStore:
+    """Reference-counted owner of one Q-table shared by every agent that plays with it.
+
+    The first `acquire` loads the table with `load`, passing on its arguments; later ones hand out the same
+    object and ignore theirs, so start-up time and memory don't grow with the number of agents and their
+    updates all land in one table.
+    The table is dropped once the last holder releases it and loaded again on the next `acquire`.
+    """
+    def __init__(self, load):
+        self.load = load
+        self.q_table = None
+        self.refs = 0
+
+    def acquire(self, *args):
+        if self.q_table is None:
+            self.q_table = self.load(*args)
+        self.refs += 1
+        return self.q_table
+
+    def release(self):
+        if self.refs == 0:
+            raise RuntimeError('policy released more often than it was acquired')
+        self.refs -= 1
+        if self.refs == 0:
+            self.q_table = None
@@ -1,18 +1,21 @@
 import pygame
 import sys
 import math
-import random
-import pickle
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 
-# Initialize Pygame
-pygame.init()
+from _clock import StepClock, ms_to_steps
+from _checkpoint import load_q_table as load_checkpointed_q_table, CheckpointWriter
+from _discretize import TURRET_DISCRETIZER, legacy_turret_angles
+from _actions import TURRET_ACTIONS, TURRET_ACTION_NAMES
+from _metrics import MetricsLog
+from _seeding import resolve_seed, add_argument as add_seed_argument
+from _profiling import NULL_PROFILER, add_arguments as add_profiling_arguments, from_args as profiler_from_args, cprofile
+from _spatial import WallIndex
+from _bullets import BulletPool
 
 # Screen settings
 SCREEN_WIDTH, SCREEN_HEIGHT = 500, 500
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("CQB AI Game")
 
 # Color definitions
 WHITE = (255, 255, 255)
@@ -22,18 +25,17 @@ ENEMY_COLOR = (255, 0, 0)
 WALL_COLOR = (50, 50, 50)
 
 # Q-learning settings
-MODEL_FILE = './models/precision.pkl'
-ACTION_SPACE = ['rotate_left', 'rotate_right', 'shoot']
+MODEL_FILE = './models/precision.qtc'
+METRICS_FILE = './logs/precision.jsonl'
+LEGACY_MODEL_FILE = './models/precision.pkl'  # Converted on first load when no checkpoint exists
 ALPHA = 0.4  # Learning rate
 GAMMA = 0.9  # Discount factor
 EPSILON = 0.4  # Exploration rate
 
-# Load or initialize Q-table
-try:
-    with open(MODEL_FILE, 'rb') as f:
-        q_table = pickle.load(f)
-except FileNotFoundError:
-    q_table = {}  # Initialize empty Q-table
+# Timing settings, counted in simulation steps (the real-time game runs at 60 FPS)
+FPS = 60
+SHOT_COOLDOWN = ms_to_steps(500, FPS)
+EPISODE_LENGTH = ms_to_steps(10000, FPS)
 
 # Bullet settings
 BULLET_SPEED = 20
@@ -46,32 +48,44 @@ VIEW_ANGLE = 90  # The total angle of the player's field of view
 PLAYER_SIZE = 20
 PLAYER_SPEED = 3
 PLAYER_ROTATION_SPEED = 4
+PLAYER_COUNT = 5
 
 # Text settings
 FONT_SIZE = 36
-font = pygame.font.Font(None, FONT_SIZE)
+
+def load_q_table():
+    q_table = load_checkpointed_q_table(MODEL_FILE, LEGACY_MODEL_FILE, len(TURRET_ACTIONS), TURRET_ACTION_NAMES)
+    if len(q_table) and isinstance(next(q_table.all_states()), tuple):
+        # Older models keyed states by (int(angle / 10),)
+        q_table = TURRET_DISCRETIZER.rekey(q_table, legacy_turret_angles(q_table.all_states()))
+    return q_table
+
+def checkpoint_writer(seed=None):
+    return CheckpointWriter(MODEL_FILE, {'script': 'precision', 'actions': TURRET_ACTION_NAMES, 'seed': seed})
 
 # Player class
 class Player:
-    def __init__(self, x, y, color, is_ai=False):
+    def __init__(self, x, y, color, q_table, clock, is_ai=False, rng=None):
         self.sensors = []
+        self.rng = np.random.default_rng() if rng is None else rng
         self.rect = pygame.Rect(x, y, PLAYER_SIZE, PLAYER_SIZE)
         self.color = color
         self.angle = 0
         self.speed = PLAYER_SPEED
         self.rotation_speed = PLAYER_ROTATION_SPEED
-        self.bullets = []
+        self.bullets = BulletPool(BULLET_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT, BULLET_COLOR)
         self.is_ai = is_ai
         self.reward = 0
         self.last_shot_time = 0
         self.previous_state = None
         self.previous_action = None
+        self.q_table = q_table
+        self.clock = clock
 
     def move(self, walls, enemy):
-        
         if self.is_ai:
             self.ai_move(walls, enemy)
-        self.draw(screen)
+        self.check_laser(enemy)
 
     def ai_move(self, walls, enemy):
         current_state = self.extract_state(enemy)
@@ -83,10 +97,7 @@ class Player:
 
         # Update Q-table
         if self.previous_state is not None and self.previous_action is not None:
-            reward = self.reward
-            best_future_q = max(q_table.get((current_state, a), 0) for a in ACTION_SPACE)
-            old_q = q_table.get((self.previous_state, self.previous_action), 0)
-            q_table[(self.previous_state, self.previous_action)] = old_q + ALPHA * (reward + GAMMA * best_future_q - old_q)
+            self.q_table.update(self.previous_state, self.previous_action, self.reward, current_state, ALPHA, GAMMA)
 
         self.previous_state = current_state
         self.previous_action = action
@@ -94,24 +105,20 @@ class Player:
         # Reward is adjusted during specific actions, but not reset after each move
 
     def choose_action(self, state):
-        if random.uniform(0, 1) < EPSILON:
-            return random.choice(ACTION_SPACE)  # Explore
+        if self.rng.random() < EPSILON:
+            return int(self.rng.integers(len(TURRET_ACTIONS)))  # Explore
         else:
             # Exploit: choose the action with the highest Q-value
-            q_values = {action: q_table.get((state, action), 0) for action in ACTION_SPACE}
-            return max(q_values, key=q_values.get)
-
-    def perform_action(self, action):
-        if action == 'rotate_left':
-            self.angle = (self.angle - self.rotation_speed) % 360
-        elif action == 'rotate_right':
-            self.angle = (self.angle + self.rotation_speed) % 360
-        elif action == 'shoot':
+            return self.q_table.best_action(state, self.rng)
+
+    def perform_action(self, action_index):
+        _, rotate, shoot = TURRET_ACTIONS[action_index].tolist()
+        self.angle = (self.angle + rotate * self.rotation_speed) % 360
+        if shoot:
             self.shoot()
 
     def extract_state(self, enemy):
-        angle_to_enemy = self.angle_to_enemy(enemy)
-        return (int(angle_to_enemy / 10),)  # Discretize the angle to enemy
+        return TURRET_DISCRETIZER.state((self.angle_to_enemy(enemy),))
 
     def angle_to_enemy(self, enemy):
         dx = enemy.rect.centerx - self.rect.centerx
@@ -129,35 +136,35 @@ class Player:
         return angle_to_enemy <= 5
 
     def shoot(self):
-        current_time = pygame.time.get_ticks()
-        if current_time - self.last_shot_time > 500:
+        current_time = self.clock.ticks
+        if current_time - self.last_shot_time > SHOT_COOLDOWN:
             angle_rad = math.radians(self.angle)
             bullet_dx = BULLET_SPEED * math.cos(angle_rad)
             bullet_dy = BULLET_SPEED * math.sin(angle_rad)
-            bullet = Bullet(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy, BULLET_COLOR)
-            self.bullets.append(bullet)
+            self.bullets.spawn(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy)
             self.last_shot_time = current_time
 
     def update_bullets(self, walls, enemy):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            if bullet.is_off_screen():
-                self.bullets.remove(bullet)
-                if self.is_ai:
-                    self.reward -= 100  # Penalty for shooting and missing
-            else:
-                for wall in walls:
-                    if bullet.rect.colliderect(wall):
-                        self.bullets.remove(bullet)
-                        if self.is_ai:
-                            self.reward -= 100  # Penalty for hitting a wall
-                        break
-                if bullet in self.bullets and bullet.rect.colliderect(enemy.rect):
-                    self.bullets.remove(bullet)
-                    if self.is_ai:
-                        self.reward += 1000  # Large reward for successfully hitting the enemy
+        if not self.bullets:
+            return
+        off_screen, hit_wall, hit_enemy = self.bullets.step([enemy.rect], walls)
+        if self.is_ai:
+            self.reward -= 100 * int(off_screen.sum())  # Penalty for shooting and missing
+            self.reward -= 100 * int(hit_wall.sum())  # Penalty for hitting a wall
+            self.reward += 1000 * int((hit_enemy >= 0).sum())  # Large reward for successfully hitting the enemy
 
-    def draw(self, surface):
+    def laser_end(self):
+        laser_end_x = self.rect.centerx + 1000 * math.cos(math.radians(self.angle))
+        laser_end_y = self.rect.centery + 1000 * math.sin(math.radians(self.angle))
+        return laser_end_x, laser_end_y
+
+    def check_laser(self, enemy):
+        laser_end_x, laser_end_y = self.laser_end()
+        if pygame.Rect(laser_end_x, laser_end_y, 1, 1).colliderect(enemy.rect):
+            if self.is_ai:
+                self.reward += 150  # Bonus for directly targeting the enemy
+
+    def draw(self, surface, font):
         # Draw the viewing area
         start_angle = math.radians(self.angle - VIEW_ANGLE / 2)
         end_angle = math.radians(self.angle + VIEW_ANGLE / 2)
@@ -168,36 +175,12 @@ class Player:
             points.append((x, y))
         viewing_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SRCALPHA)
         pygame.draw.polygon(viewing_surface, (0, 255, 0, 20), points, 0)  # Increased transparency
-        surface.blit(viewing_surface, (0, 0))        
+        surface.blit(viewing_surface, (0, 0))
         reward_text = font.render(f"Reward: {round(self.reward)}", True, (0, 0, 0))
         surface.blit(reward_text, (10, 70))
-        laser_end_x = self.rect.centerx + 1000 * math.cos(math.radians(self.angle))
-        laser_end_y = self.rect.centery + 1000 * math.sin(math.radians(self.angle))
-        pygame.draw.line(surface, (255, 0, 0), self.rect.center, (laser_end_x, laser_end_y), 1)
-        if pygame.Rect(laser_end_x, laser_end_y, 1, 1).colliderect(enemy.rect):
-            if self.is_ai:
-                self.reward += 150  # Bonus for directly targeting the enemy
-        pygame.draw.rect(surface, self.color, self.rect)
-        for bullet in self.bullets:
-            bullet.draw(surface)
-
-# Bullet class
-class Bullet:
-    def __init__(self, x, y, dx, dy, color):
-        self.rect = pygame.Rect(x, y, BULLET_SIZE, BULLET_SIZE)
-        self.dx = dx
-        self.dy = dy
-        self.color = color
-
-    def move(self):
-        self.rect.x += round(self.dx)
-        self.rect.y += round(self.dy)
-
-    def is_off_screen(self):
-        return not (0 <= self.rect.x <= SCREEN_WIDTH and 0 <= self.rect.y <= SCREEN_HEIGHT)
-
-    def draw(self, surface):
+        pygame.draw.line(surface, (255, 0, 0), self.rect.center, self.laser_end(), 1)
         pygame.draw.rect(surface, self.color, self.rect)
+        self.bullets.draw(surface)
 
 # Enemy class
 class Enemy:
@@ -208,71 +191,172 @@ class Enemy:
     def draw(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
 
-# Create players, enemy, and walls in a small room
-players = [Player(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, PLAYER_COLOR, is_ai=True) for _ in range(5)]
-enemy = Enemy(random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50), ENEMY_COLOR)
-walls = [
-    pygame.Rect(0, 0, SCREEN_WIDTH, 10),  # Top wall
-    pygame.Rect(0, SCREEN_HEIGHT - 10, SCREEN_WIDTH, 10),  # Bottom wall
-    pygame.Rect(0, 0, 10, SCREEN_HEIGHT),  # Left wall
-    pygame.Rect(SCREEN_WIDTH - 10, 0, 10, SCREEN_HEIGHT)  # Right wall
-]
-
-# Main game loop
-clock = pygame.time.Clock()
-game_start_time = pygame.time.get_ticks()
-total_rewards = []
-
-while True:
-    # Reset game after 10 seconds
-    if len(total_rewards) > 0 and len(total_rewards) % 10 == 0:
-        plt.plot(total_rewards)
-        plt.xlabel('Game Number')
-        plt.ylabel('Total Reward')
-        plt.title('AI Learning Progress Over Time')
-        plt.savefig('learning_progress.png')
-        plt.close()
-    if pygame.time.get_ticks() - game_start_time > 10000:
-        best_player = max(players, key=lambda p: p.reward)
-        total_rewards.append(round(best_player.reward))
-        with open(MODEL_FILE, 'wb') as f:
-            pickle.dump(q_table, f)
-        print(f'Game Over. Best Reward: {best_player.reward}')
-        game_start_time = pygame.time.get_ticks()
-        for player in players:
+def create_enemy(rng):
+    x = int(rng.integers(50, SCREEN_WIDTH - 50, endpoint=True))
+    y = int(rng.integers(50, SCREEN_HEIGHT - 50, endpoint=True))
+    return Enemy(x, y, ENEMY_COLOR)
+
+# Arena class
+class Arena:
+    """The small walled room with one enemy and the AI players, advanced one step at a time.
+
+    All random draws come from one generator seeded with `seed`, so equal seeds replay the same run.
+    """
+    def __init__(self, q_table, player_count=PLAYER_COUNT, profiler=NULL_PROFILER, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.clock = StepClock()
+        self.profiler = profiler
+        self.players = [Player(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2, PLAYER_COLOR, q_table, self.clock, is_ai=True,
+                               rng=self.rng)
+                        for _ in range(player_count)]
+        self.enemy = create_enemy(self.rng)
+        self.walls = WallIndex([
+            pygame.Rect(0, 0, SCREEN_WIDTH, 10),  # Top wall
+            pygame.Rect(0, SCREEN_HEIGHT - 10, SCREEN_WIDTH, 10),  # Bottom wall
+            pygame.Rect(0, 0, 10, SCREEN_HEIGHT),  # Left wall
+            pygame.Rect(SCREEN_WIDTH - 10, 0, 10, SCREEN_HEIGHT)  # Right wall
+        ])
+        self.game_start_time = self.clock.ticks
+
+    def best_player(self):
+        return max(self.players, key=lambda p: p.reward)
+
+    def is_game_over(self):
+        return self.clock.ticks - self.game_start_time > EPISODE_LENGTH
+
+    def reset(self):
+        self.game_start_time = self.clock.ticks
+        for player in self.players:
             player.reward = 0  # Reset reward after game end
             player.rect.x, player.rect.y = SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2
-        enemy = Enemy(random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50), ENEMY_COLOR)
-        continue
-    if pygame.time.get_ticks() - game_start_time > 10000:
-        with open(MODEL_FILE, 'wb') as f:
-            pickle.dump(q_table, f)
-        pygame.quit()
-        sys.exit()
-    
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            with open(MODEL_FILE, 'wb') as f:
-                pickle.dump(q_table, f)
-            pygame.quit()
-            sys.exit()
-
-    # Update game state
-    for player in players:
-        player.move(walls, enemy)
-        player.update_bullets(walls, enemy)
-
-    # Draw
-    screen.fill(WHITE)
-    for wall in walls:
-        pygame.draw.rect(screen, WALL_COLOR, wall)
-    for player in players:
-        player.draw(screen)
-    enemy.draw(screen)
-
-    best_player = max(players, key=lambda p: p.reward)
-    reward_text = font.render(f"Best Player Reward: {best_player.reward}", True, (0, 0, 0))
-    screen.blit(reward_text, (10, 40))
-
-    pygame.display.flip()
-    clock.tick(60)
\ No newline at end of file
+        self.enemy = create_enemy(self.rng)
+
+    def step(self):
+        profiler = self.profiler
+        for player in self.players:
+            with profiler.phase('move'):
+                player.move(self.walls, self.enemy)
+            with profiler.phase('update_bullets'):
+                player.update_bullets(self.walls, self.enemy)
+        self.clock.tick()
+
+# Renderer class
+class Renderer:
+    """Opens the window on creation and draws the arena every `every` steps."""
+    def __init__(self, every=1):
+        pygame.init()
+        self.every = every
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("CQB AI Game")
+        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.clock = pygame.time.Clock()
+        self.profiler = NULL_PROFILER
+
+    def handle_events(self):
+        # Returns False once the window has been closed
+        return not any(event.type == pygame.QUIT for event in pygame.event.get())
+
+    def draw(self, arena):
+        screen = self.screen
+        screen.fill(WHITE)
+        for wall in arena.walls:
+            pygame.draw.rect(screen, WALL_COLOR, wall)
+        for player in arena.players:
+            player.draw(screen, self.font)
+        arena.enemy.draw(screen)
+
+        best_player = arena.best_player()
+        reward_text = self.font.render(f"Best Player Reward: {best_player.reward}", True, (0, 0, 0))
+        screen.blit(reward_text, (10, 40))
+
+        with self.profiler.phase('display_flip'):
+            pygame.display.flip()
+        # Only cap the frame rate when every step is shown, otherwise train at full speed
+        if self.every == 1:
+            self.clock.tick(FPS)
+
+# Trainer class
+class Trainer:
+    """Runs the arena game after game, saving the Q-table and logging metrics between games."""
+    def __init__(self, arena, q_table, checkpoints, metrics, renderer=None):
+        self.arena = arena
+        self.q_table = q_table
+        self.checkpoints = checkpoints
+        self.metrics = metrics
+        self.renderer = renderer
+
+    def end_game(self):
+        arena = self.arena
+        best_player = arena.best_player()
+        rewards = [player.reward for player in arena.players]
+        self.metrics.log(steps=arena.clock.ticks, episode_steps=arena.clock.ticks - arena.game_start_time,
+                         best_reward=best_player.reward, mean_reward=sum(rewards) / len(rewards),
+                         epsilon=EPSILON, q_table_states=len(self.q_table))
+        with self.arena.profiler.phase('checkpoint'):
+            self.checkpoints.save(self.q_table)
+        print(f'Game Over. Best Reward: {best_player.reward}')
+        self.arena.reset()
+
+    def run(self, max_steps=None):
+        arena = self.arena
+        renderer = self.renderer
+        while max_steps is None or arena.clock.ticks < max_steps:
+            # Reset game after 10 seconds
+            if arena.is_game_over():
+                self.end_game()
+                continue
+
+            render = renderer is not None and arena.clock.ticks % renderer.every == 0
+            if render and not renderer.handle_events():
+                break
+
+            arena.step()
+
+            if render:
+                with arena.profiler.phase('render'):
+                    renderer.draw(arena)
+            arena.profiler.step()
+
+def main(headless=False, render_every=1, max_steps=None, profiler=NULL_PROFILER, metrics_path=METRICS_FILE,
+         seed=None):
+    seed = resolve_seed(seed)
+    print(f'Seed: {seed}')
+    q_table = load_q_table()
+    renderer = None if headless else Renderer(render_every)
+    if renderer is not None:
+        renderer.profiler = profiler
+    profiler.watch('q_table_states', lambda: len(q_table))
+    checkpoints = checkpoint_writer(seed)
+    metrics = MetricsLog(metrics_path)
+    trainer = Trainer(Arena(q_table, profiler=profiler, seed=seed), q_table, checkpoints, metrics, renderer)
+    try:
+        trainer.run(max_steps)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiler.close()
+        metrics.close()
+    checkpoints.save(q_table)
+    checkpoints.close()
+    pygame.quit()
+    sys.exit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CQB precision aiming with Q-Learning")
+    parser.add_argument('--headless', action='store_true',
+                        help='train without a window, rendering or frame cap')
+    parser.add_argument('--render-every', type=int, default=1,
+                        help='draw one frame every N steps; the FPS cap only applies when N is 1')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='stop after this many steps and save the model')
+    add_seed_argument(parser)
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='append one JSON line of episode metrics per game to this file')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with cprofile(args.profile):
+        main(headless=args.headless, render_every=args.render_every, max_steps=args.steps,
+             profiler=profiler_from_args(args), metrics_path=args.metrics, seed=args.seed)
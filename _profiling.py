@@ -0,0 +1,170 @@
+import csv
+import json
+import time
+import cProfile
+import contextlib
+from collections import defaultdict
+
+STATS_EVERY = 1000  # Steps between stats rows
+
+
+class _Phase:
+    __slots__ = ('times', 'calls', 'name', 'start')
+
+    def __init__(self, times, calls, name):
+        self.times = times
+        self.calls = calls
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.times[self.name] += time.perf_counter() - self.start
+        self.calls[self.name] += 1
+
+
+class Profiler:
+    """Wall time per named phase, counters and watched values of a training loop.
+
+    Every `every` steps one row goes to `path`, as CSV or as JSON lines for a .jsonl path, with the
+    step rate and, per phase, its share of the interval and mean time per call since the last row.
+    """
+    enabled = True
+
+    def __init__(self, path, every=STATS_EVERY):
+        self.path = path
+        self.every = every
+        self.jsonl = path.endswith('.jsonl')
+        self.file = open(path, 'w', newline='')
+        self.writer = None
+        self.phases = {}
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.watches = {}
+        self.steps = 0
+        self.start_time = self.last_time = time.perf_counter()
+        self.last_steps = 0
+
+    def phase(self, name):
+        # Context manager timing one pass through the phase
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(self.times, self.calls, name)
+        return phase
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def watch(self, name, read):
+        # read() is called for each stats row, so watched values cost nothing between rows
+        self.watches[name] = read
+
+    def step(self, n=1):
+        self.steps += n
+        if self.steps - self.last_steps >= self.every:
+            self.dump()
+
+    def dump(self):
+        now = time.perf_counter()
+        interval = now - self.last_time
+        steps = self.steps - self.last_steps
+        row = {
+            'steps': self.steps,
+            'wall_time': round(now - self.start_time, 3),
+            'steps_per_sec': round(steps / interval, 1) if interval else None,
+        }
+        for name, seconds in self.times.items():
+            row[f'{name}_share'] = round(seconds / interval, 4) if interval else None
+            row[f'{name}_us'] = round(1e6 * seconds / self.calls[name], 2)
+        row.update(self.counters)
+        for name, read in self.watches.items():
+            row[name] = read()
+        self._write(row)
+        self.times.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.last_time = now
+        self.last_steps = self.steps
+
+    def _write(self, row):
+        if self.jsonl:
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            if self.writer is None:
+                # The columns are fixed by the first row; phases first seen later are left out
+                self.writer = csv.DictWriter(self.file, fieldnames=list(row), extrasaction='ignore')
+                self.writer.writeheader()
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.steps > self.last_steps:
+            self.dump()
+        self.file.close()
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullProfiler:
+    """Stand-in used when stats are off; every call returns immediately."""
+    enabled = False
+    _phase = _NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def watch(self, name, read):
+        pass
+
+    def step(self, n=1):
+        pass
+
+    def dump(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+@contextlib.contextmanager
+def cprofile(path):
+    # Run the block under cProfile and write its stats to `path` (for pstats or snakeviz); no-op without a path
+    if not path:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+
+def add_arguments(parser):
+    parser.add_argument('--stats', default=None,
+                        help='write per-phase timings and counters to this .csv or .jsonl file')
+    parser.add_argument('--stats-every', type=int, default=STATS_EVERY,
+                        help='steps between rows of the --stats file')
+    parser.add_argument('--profile', default=None,
+                        help='run under cProfile and write the stats to this file')
+
+
+def from_args(args):
+    return Profiler(args.stats, args.stats_every) if args.stats else NULL_PROFILER
@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+
+from _checkpoint import atomic_write
+
+HIDDEN_SIZE = 64        # Units of the hidden layer; 0 makes the network linear
+LEARNING_RATE = 0.01
+TARGET_SYNC = 500       # Training batches between copies of the online weights to the target network
+MAX_TD_ERROR = 1.0      # TD errors are clipped to this, the gradient of a Huber loss
+
+
+class QNetwork:
+    """Q-function over float32 observation vectors, linear or with one hidden ReLU layer.
+
+    Scoring a batch of observations is one matmul per layer, however many agents it holds. Training
+    is minibatch SGD on the clipped TD error, with targets from a copy of the weights that is only
+    refreshed every `target_sync` batches. Observations are multiplied by `input_scale` first.
+    """
+    def __init__(self, n_inputs, n_actions, hidden=HIDDEN_SIZE, input_scale=None, lr=LEARNING_RATE,
+                 target_sync=TARGET_SYNC, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        self.n_inputs = n_inputs
+        self.n_actions = n_actions
+        self.hidden = hidden
+        self.input_scale = np.ones(n_inputs, dtype=np.float32) if input_scale is None \
+            else np.asarray(input_scale, dtype=np.float32)
+        self.lr = lr
+        self.target_sync = target_sync
+        sizes = [n_inputs, hidden, n_actions] if hidden else [n_inputs, n_actions]
+        # He initialisation for the ReLU layers
+        self.weights = [(rng.standard_normal((n_in, n_out)) * np.sqrt(2 / n_in)).astype(np.float32)
+                        for n_in, n_out in zip(sizes[:-1], sizes[1:])]
+        self.biases = [np.zeros(n_out, dtype=np.float32) for n_out in sizes[1:]]
+        self.updates = 0
+        self.sync_target()
+
+    def sync_target(self):
+        self.target_weights = [w.copy() for w in self.weights]
+        self.target_biases = [b.copy() for b in self.biases]
+
+    def _forward(self, observations, weights, biases):
+        # Activations of every layer, the input first and the Q-values last
+        x = np.asarray(observations, dtype=np.float32) * self.input_scale
+        activations = [x]
+        for i, (w, b) in enumerate(zip(weights, biases)):
+            x = x @ w + b
+            if i < len(weights) - 1:
+                x = np.maximum(x, 0)
+            activations.append(x)
+        return activations
+
+    def q_values(self, observations):
+        # (n, n_actions) Q-values of an (n, n_inputs) batch
+        return self._forward(observations, self.weights, self.biases)[-1]
+
+    def best_actions(self, observations):
+        return self.q_values(observations).argmax(axis=1)
+
+    def best_action(self, observation, rng=None):
+        # Continuous Q-values practically never tie, so `rng`, taken for the QTable signature, goes unused
+        return int(self.q_values(np.asarray(observation)[None])[0].argmax())
+
+    def train_batch(self, observations, actions, rewards, next_observations, gamma):
+        # One SGD step towards r + gamma * max_a' Q_target(s', a'); returns the mean squared TD error
+        n = len(actions)
+        next_q = self._forward(next_observations, self.target_weights, self.target_biases)[-1]
+        targets = np.asarray(rewards, dtype=np.float32) + gamma * next_q.max(axis=1)
+
+        activations = self._forward(observations, self.weights, self.biases)
+        rows = np.arange(n)
+        errors = activations[-1][rows, actions] - targets
+        grad = np.zeros_like(activations[-1])
+        grad[rows, actions] = np.clip(errors, -MAX_TD_ERROR, MAX_TD_ERROR) / n
+
+        for i in range(len(self.weights) - 1, -1, -1):
+            grad_w = activations[i].T @ grad
+            grad_b = grad.sum(axis=0)
+            if i > 0:
+                grad = (grad @ self.weights[i].T) * (activations[i] > 0)
+            self.weights[i] -= self.lr * grad_w
+            self.biases[i] -= self.lr * grad_b
+
+        self.updates += 1
+        if self.updates % self.target_sync == 0:
+            self.sync_target()
+        return float(np.mean(errors ** 2))
+
+
+def save_network(path, network, metadata=None):
+    arrays = {'input_scale': network.input_scale, 'metadata': np.array(json.dumps(metadata or {})),
+              'config': np.array([network.n_inputs, network.n_actions, network.hidden, network.updates]),
+              'lr': np.array(network.lr), 'target_sync': np.array(network.target_sync)}
+    for i, (w, b) in enumerate(zip(network.weights, network.biases)):
+        arrays[f'w{i}'] = w
+        arrays[f'b{i}'] = b
+    with atomic_write(path) as f:
+        np.savez(f, **arrays)
+
+
+def load_network(path):
+    with np.load(path) as arrays:
+        n_inputs, n_actions, hidden, updates = arrays['config'].tolist()
+        network = QNetwork(n_inputs, n_actions, hidden, arrays['input_scale'], float(arrays['lr']),
+                           int(arrays['target_sync']))
+        network.weights = [arrays[f'w{i}'] for i in range(len(network.weights))]
+        network.biases = [arrays[f'b{i}'] for i in range(len(network.biases))]
+    network.updates = updates
+    network.sync_target()
+    return network
@@ -0,0 +1,297 @@
+import numpy as np
+
+INITIAL_CAPACITY = 1024
+EVICT_LRU = 'lru'        # Evict the states updated least recently
+EVICT_VISITS = 'visits'  # Evict the states updated least often
+EVICT_FRACTION = 0.1     # A full bounded table evicts this share of its capacity at once
+
+
+def encode_state(state):
+    # States are tuples of numbers (or a single number); keys are their float64 values
+    key = np.array(state if isinstance(state, tuple) else (state,), dtype=np.float64)
+    return key + 0.0  # Folds -0.0 into 0.0 so equal states have equal bytes
+
+
+def key_view(keys):
+    # View each row of a (n, width) float64 key array as one opaque value that sorts and compares by bytes
+    keys = np.ascontiguousarray(keys, dtype=np.float64)
+    return keys.view(np.dtype((np.void, keys.shape[1] * 8))).ravel()
+
+
+def best_of(q_values, rng):
+    # Index of the largest of a list of Q-values, ties broken by `rng`; plain Python beats NumPy on one row
+    best = max(q_values)
+    ties = [i for i, q in enumerate(q_values) if q == best]
+    if len(ties) == 1:
+        return ties[0]
+    return ties[int(rng.integers(len(ties)))]
+
+
+class QTable:
+    """Q-values kept as rows of a preallocated float32 array, one row per discretized state.
+
+    A table loaded from a checkpoint keeps its saved states as a sorted key array (the base)
+    that is binary-searched on first use; states added afterwards get rows after the base.
+    """
+    evicted = 0  # States dropped by eviction; only a BoundedQTable drops any
+
+    def __init__(self, n_actions, capacity=INITIAL_CAPACITY):
+        self.n_actions = n_actions
+        self.values = np.zeros((capacity, n_actions), dtype=np.float32)
+        self.dirty = np.zeros(capacity, dtype=bool)  # Rows changed since the last checkpoint
+        self.index = {}   # state -> row, for new states and base states looked up so far
+        self.states = []  # states of the rows after the base, in row order
+        self.base_keys = None
+        self.base_size = 0
+        self.key_types = None  # Python type of each key column, to decode base keys back into states
+        self.key_tuple = True
+
+    def __len__(self):
+        return self.base_size + len(self.states)
+
+    def __contains__(self, state):
+        return self.lookup(state) is not None
+
+    def lookup(self, state):
+        # Row of `state`, or None if it has never been seen
+        row = self.index.get(state)
+        if row is None and self.base_size:
+            row = self._search_base(state)
+            if row is not None:
+                self.index[state] = row
+        return row
+
+    def _search_base(self, state):
+        key = encode_state(state)
+        if len(key) != len(self.key_types):
+            return None
+        key = key_view(key[None])[0]
+        i = int(np.searchsorted(self.base_keys, key))
+        if i < self.base_size and self.base_keys[i] == key:
+            return i
+        return None
+
+    def row(self, state):
+        # Row of `state`, allocating a zeroed row the first time the state is seen
+        row = self.lookup(state)
+        if row is None:
+            row = len(self)
+            if row == len(self.values):
+                self._grow()
+            self.index[state] = row
+            self.states.append(state)
+            self.dirty[row] = True
+        return row
+
+    def decode_key(self, key):
+        state = tuple(kind(value) for kind, value in zip(self.key_types, key.tolist()))
+        return state if self.key_tuple else state[0]
+
+    def row_keys(self, rows):
+        # (len(rows), width) float64 keys of the given rows
+        in_base = rows < self.base_size
+        new_keys = [encode_state(self.states[row - self.base_size]) for row in rows[~in_base].tolist()]
+        if self.base_size:
+            width = len(self.key_types)
+        else:
+            width = len(new_keys[0]) if new_keys else 0
+        keys = np.empty((len(rows), width), dtype=np.float64)
+        if self.base_size:
+            keys[in_base] = self.base_keys.view(np.float64).reshape(self.base_size, -1)[rows[in_base]]
+        if new_keys:
+            keys[~in_base] = new_keys
+        return keys
+
+    def take_dirty(self):
+        # Rows changed since the last call, clearing their flags
+        rows = np.flatnonzero(self.dirty[:len(self)])
+        self.dirty[rows] = False
+        return rows
+
+    def all_states(self):
+        # Every state in row order
+        if self.base_size:
+            keys = self.base_keys.view(np.float64).reshape(self.base_size, -1)
+            for key in keys:
+                yield self.decode_key(key)
+        yield from self.states
+
+    def copy(self):
+        # Compact in-memory copy, e.g. a policy snapshot to ship to other processes
+        n = len(self)
+        table = QTable(self.n_actions, capacity=max(1, n))
+        table.values[:n] = self.values[:n]
+        table.index = dict(self.index)
+        table.states = list(self.states)
+        if self.base_size:
+            table.base_keys = np.array(self.base_keys)
+            table.base_size = self.base_size
+            table.key_types = self.key_types
+            table.key_tuple = self.key_tuple
+        return table
+
+    def _grow(self):
+        values = np.zeros((max(2 * len(self.values), INITIAL_CAPACITY), self.n_actions), dtype=np.float32)
+        values[:len(self.values)] = self.values
+        self.values = values
+        dirty = np.zeros(len(values), dtype=bool)
+        dirty[:len(self.dirty)] = self.dirty
+        self.dirty = dirty
+
+    def max_q(self, state):
+        row = self.lookup(state)
+        if row is None:
+            return 0.0
+        # One conversion to a list and a builtin max beat NumPy's per-call overhead on a single row
+        return max(self.values[row].tolist())
+
+    def best_action(self, state, rng):
+        # Ties are broken with a draw from the np.random.Generator `rng`, taken only when there is a tie
+        row = self.lookup(state)
+        if row is None:
+            # Unseen states are all zeros, so every action ties
+            return int(rng.integers(self.n_actions))
+        return best_of(self.values[row].tolist(), rng)
+
+    def update(self, state, action, reward, next_state, alpha, gamma):
+        # Read the next state before allocating, since allocation may grow the array
+        max_next_q = self.max_q(next_state)
+        row = self.row(state)
+        # Plain Python floats throughout: NumPy scalar arithmetic costs more than the update itself
+        q = self.values.item(row, action)
+        self.values[row, action] = q + alpha * (reward + gamma * max_next_q - q)
+        self.dirty[row] = True
+
+    def update_batch(self, rows, actions, rewards, next_rows, alpha, gamma):
+        # Vectorized TD update over row indices; for repeated (row, action) pairs the last write wins
+        max_next_q = self.values[next_rows].max(axis=1)
+        q = self.values[rows, actions]
+        self.values[rows, actions] = q + alpha * (rewards + gamma * max_next_q - q)
+        self.dirty[rows] = True
+
+    @classmethod
+    def from_base(cls, keys, values, key_types, key_tuple):
+        # Table over sorted (n, width) float64 keys and their (n, n_actions) values, e.g. memory-mapped arrays
+        table = cls(values.shape[1], capacity=0)
+        table.values = values
+        table.dirty = np.zeros(len(values), dtype=bool)
+        table.base_keys = key_view(keys)
+        table.base_size = len(keys)
+        table.key_types = key_types
+        table.key_tuple = key_tuple
+        return table
+
+    @classmethod
+    def from_dict(cls, q_table, n_actions):
+        # Convert a legacy {state: [q per action]} dict as stored in models/game.pkl
+        table = cls(n_actions, capacity=max(INITIAL_CAPACITY, len(q_table)))
+        for state, q_values in q_table.items():
+            table.values[table.row(state)] = q_values
+        return table
+
+    def to_dict(self):
+        return {state: self.values[row].tolist() for row, state in enumerate(self.all_states())}
+
+    @classmethod
+    def from_pairs(cls, q_table, actions):
+        # Convert a legacy {(state, action_name): q} dict as stored in models/precision.pkl and models/targeting.pkl
+        table = cls(len(actions), capacity=max(INITIAL_CAPACITY, len(q_table)))
+        for (state, action), q in q_table.items():
+            table.values[table.row(state), actions.index(action)] = q
+        return table
+
+
+class BoundedQTable(QTable):
+    """QTable holding at most `max_states` states, evicting the least useful ones once it is full.
+
+    Every update stamps its row with a use counter and a visit count. When an update leaves the table
+    over capacity, the `EVICT_FRACTION` of states least recently used (EVICT_LRU) or least visited
+    (EVICT_VISITS) are dropped in one pass and the remaining rows are renumbered, keeping the order of
+    the base and of the rows after it. Row numbers held across an update or `evict` call are therefore
+    stale; `update_batch` callers call `evict` themselves once they are done with their rows.
+    """
+    def __init__(self, n_actions, max_states, policy=EVICT_LRU, capacity=INITIAL_CAPACITY):
+        if policy not in (EVICT_LRU, EVICT_VISITS):
+            raise ValueError(f'unknown eviction policy {policy!r}')
+        super().__init__(n_actions, capacity)
+        self.max_states = max_states
+        self.policy = policy
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.int64)
+        self.clock = 0
+        self.evicted = 0
+        self.evictions = 0  # Eviction passes
+
+    @classmethod
+    def from_table(cls, q_table, max_states, policy=EVICT_LRU):
+        # Bounded table taking over the rows of `q_table`, e.g. one just loaded from a checkpoint
+        table = cls(q_table.n_actions, max_states, policy, capacity=0)
+        table.values = q_table.values
+        table.dirty = q_table.dirty
+        table.index = q_table.index
+        table.states = q_table.states
+        table.base_keys = q_table.base_keys
+        table.base_size = q_table.base_size
+        table.key_types = q_table.key_types
+        table.key_tuple = q_table.key_tuple
+        table.visits = np.zeros(len(table.values), dtype=np.int64)
+        table.last_used = np.zeros(len(table.values), dtype=np.int64)
+        table.evict()
+        return table
+
+    def _grow(self):
+        super()._grow()
+        for name in ('visits', 'last_used'):
+            column = np.zeros(len(self.values), dtype=np.int64)
+            old = getattr(self, name)
+            column[:len(old)] = old
+            setattr(self, name, column)
+
+    def update(self, state, action, reward, next_state, alpha, gamma):
+        super().update(state, action, reward, next_state, alpha, gamma)
+        row = self.index[state]
+        self.clock += 1
+        self.visits[row] += 1
+        self.last_used[row] = self.clock
+        self.evict()
+
+    def update_batch(self, rows, actions, rewards, next_rows, alpha, gamma):
+        super().update_batch(rows, actions, rewards, next_rows, alpha, gamma)
+        self.clock += 1
+        np.add.at(self.visits, rows, 1)
+        self.last_used[rows] = self.clock
+
+    def evict(self):
+        # Drop states until the table is back under capacity; returns how many were dropped
+        n = len(self)
+        if n <= self.max_states:
+            return 0
+        target = max(0, self.max_states - int(self.max_states * EVICT_FRACTION))
+        if self.policy == EVICT_LRU:
+            order = np.argsort(self.last_used[:n], kind='stable')
+        else:
+            order = np.lexsort((self.last_used[:n], self.visits[:n]))
+        keep = np.ones(n, dtype=bool)
+        keep[order[:n - target]] = False
+        self._compact(keep)
+        self.evicted += n - target
+        self.evictions += 1
+        return n - target
+
+    def _compact(self, keep):
+        kept = np.flatnonzero(keep)
+        new_rows = np.full(len(keep), -1, dtype=np.int64)
+        new_rows[kept] = np.arange(len(kept))
+        capacity = max(INITIAL_CAPACITY, self.max_states + 1)
+        for name in ('values', 'dirty', 'visits', 'last_used'):
+            old = getattr(self, name)
+            column = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            column[:len(kept)] = old[kept]
+            setattr(self, name, column)
+
+        # A subset of the sorted base is still sorted, so surviving base states stay binary-searchable
+        kept_base = kept[kept < self.base_size]
+        self.base_keys = np.array(self.base_keys[kept_base]) if len(kept_base) else None
+        self.states = [self.states[row - self.base_size] for row in kept[kept >= self.base_size].tolist()]
+        self.base_size = len(kept_base)
+        self.index = {state: int(new_rows[row]) for state, row in self.index.items() if keep[row]}
@@ -0,0 +1,28 @@
+import numpy as np
+
+
+class OccupancyGrid:
+    """Static bitmap of wall pixels, built once from the wall rectangles of a map."""
+    def __init__(self, walls, width, height):
+        self.width = width
+        self.height = height
+        self.blocked = np.zeros((height, width), dtype=bool)
+        for wall in walls:
+            self.blocked[max(wall.top, 0):max(wall.bottom, 0), max(wall.left, 0):max(wall.right, 0)] = True
+
+    def cast(self, x, y, angles, max_distance, step=5):
+        """Distance from (x, y) to the first wall or screen edge along each ray, for all rays at once.
+
+        Rays are sampled every `step` pixels; rays that hit nothing return `max_distance`.
+        """
+        distances = np.arange(0, max_distance, step)
+        angles_rad = np.radians(np.asarray(angles, dtype=np.float64))
+        xs = x + np.cos(angles_rad)[:, None] * distances
+        ys = y + np.sin(angles_rad)[:, None] * distances
+        inside = (0 <= xs) & (xs < self.width) & (0 <= ys) & (ys < self.height)
+        xi = np.clip(xs.astype(np.int64), 0, self.width - 1)
+        yi = np.clip(ys.astype(np.int64), 0, self.height - 1)
+        stopped = ~inside | self.blocked[yi, xi]
+        hit = stopped.any(axis=1)
+        first = stopped.argmax(axis=1)
+        return np.where(hit, distances[first], max_distance).astype(np.float64)
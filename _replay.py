@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class ReplayBuffer:
+    """Fixed-capacity ring buffer of (state, action, reward, next_state) transitions in NumPy columns.
+
+    By default states are stored as Q-table row indices, so a sampled batch can be applied to the table
+    directly; `state_shape` and `state_dtype` store other states, e.g. float32 observation vectors.
+    """
+    def __init__(self, capacity, state_shape=(), state_dtype=np.int64, rng=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, *state_shape), dtype=state_dtype)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.next_states = np.zeros((capacity, *state_shape), dtype=state_dtype)
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng() if rng is None else rng
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, states, actions, rewards, next_states):
+        # Append a batch of transitions, e.g. one per arena of a VectorEnv step
+        n = len(states)
+        i = (self.position + np.arange(n)) % self.capacity
+        self.states[i] = states
+        self.actions[i] = actions
+        self.rewards[i] = rewards
+        self.next_states[i] = next_states
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample(self, batch_size):
+        # Uniform sampling with replacement, O(batch_size) regardless of the buffer size
+        i = self.rng.integers(0, self.size, size=batch_size)
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i]
@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def resolve_seed(seed):
+    # Runs started without a seed draw one, so it can still be recorded and the run replayed
+    return int(np.random.SeedSequence().entropy) if seed is None else seed
+
+
+def spawn_seeds(seed, n):
+    # n independent child seeds of `seed`, each starting its own np.random.Generator stream
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+def add_argument(parser):
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of every random stream in the run; it is saved with the model either way')
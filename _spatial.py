@@ -0,0 +1,84 @@
+import numpy as np
+
+CELL_SIZE = 64
+LINEAR_SCAN_WALLS = 16  # Up to this many walls, checking them all is cheaper than merging cells
+
+
+class WallIndex:
+    """Uniform grid over the map where each cell lists the walls overlapping it.
+
+    Iterating and len() behave like the plain wall list, so drawing code is unchanged, while
+    collision queries only look at the walls in the cells a rectangle touches.
+    """
+    def __init__(self, walls, cell_size=CELL_SIZE):
+        self.walls = list(walls)
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, wall in enumerate(self.walls):
+            for cell in self._cells(wall.left, wall.top, wall.right, wall.bottom):
+                self.cells.setdefault(cell, []).append(i)
+        # Ids are appended in order, so each cell's walls are already sorted
+        self.cell_walls = {cell: tuple(self.walls[i] for i in ids) for cell, ids in self.cells.items()}
+        self._build_cell_table()
+
+    def _build_cell_table(self):
+        # Dense copy of the grid for vectorized queries: wall ids per cell, padded with -1
+        self.rects = np.array([(w.left, w.top, w.width, w.height) for w in self.walls], dtype=np.int64).reshape(-1, 4)
+        cells = list(self.cells) or [(0, 0)]
+        self.origin = np.min(cells, axis=0)
+        shape = np.max(cells, axis=0) - self.origin + 1
+        depth = max((len(ids) for ids in self.cells.values()), default=1)
+        self.cell_table = np.full((shape[0], shape[1], depth), -1, dtype=np.int64)
+        for (cx, cy), ids in self.cells.items():
+            self.cell_table[cx - self.origin[0], cy - self.origin[1], :len(ids)] = ids
+
+    def __iter__(self):
+        return iter(self.walls)
+
+    def __len__(self):
+        return len(self.walls)
+
+    def _cells(self, left, top, right, bottom):
+        size = self.cell_size
+        for cx in range(left // size, (right - 1) // size + 1):
+            for cy in range(top // size, (bottom - 1) // size + 1):
+                yield cx, cy
+
+    def query(self, rect):
+        # Walls that may overlap `rect`, in their original order
+        size = self.cell_size
+        left = rect.left // size
+        top = rect.top // size
+        right = (rect.right - 1) // size
+        bottom = (rect.bottom - 1) // size
+        if left == right and top == bottom:
+            return self.cell_walls.get((left, top), ())
+        if len(self.walls) <= LINEAR_SCAN_WALLS:
+            return self.walls
+        candidates = set()
+        for cell in self._cells(rect.left, rect.top, rect.right, rect.bottom):
+            candidates.update(self.cells.get(cell, ()))
+        return [self.walls[i] for i in sorted(candidates)]
+
+    def collides(self, rect):
+        return rect.collidelist(self.query(rect)) >= 0
+
+    def collides_many(self, x, y, width, height):
+        """Vectorized `collides` for arrays of rectangles no larger than one grid cell."""
+        x = np.asarray(x)[..., None]
+        y = np.asarray(y)[..., None]
+        if not len(self.walls) or not x.size:
+            return np.zeros(x.shape[:-1], dtype=bool)
+        nx, ny, _ = self.cell_table.shape
+        # A rectangle no larger than a cell touches at most the cells under its four corners
+        gx = (x + np.array([0, width - 1, 0, width - 1])) // self.cell_size - self.origin[0]
+        gy = (y + np.array([0, 0, height - 1, height - 1])) // self.cell_size - self.origin[1]
+        inside = (0 <= gx) & (gx < nx) & (0 <= gy) & (gy < ny)
+        ids = self.cell_table[np.minimum(np.maximum(gx, 0), nx - 1), np.minimum(np.maximum(gy, 0), ny - 1)]
+        ids = np.where(inside[..., None], ids, -1)
+        wall = self.rects[np.maximum(ids, 0)]
+        x = x[..., None]
+        y = y[..., None]
+        overlap = ((x < wall[..., 0] + wall[..., 2]) & (wall[..., 0] < x + width)
+                   & (y < wall[..., 1] + wall[..., 3]) & (wall[..., 1] < y + height))
+        return (overlap & (ids >= 0)).any(axis=(-2, -1))
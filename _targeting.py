@@ -1,18 +1,21 @@
 import pygame
 import sys
 import math
-import random
-import pickle
+import argparse
 import numpy as np
-from collections import deque
 
-# Initialize Pygame
-pygame.init()
+from _clock import StepClock, ms_to_steps
+from _checkpoint import load_q_table as load_checkpointed_q_table, CheckpointWriter
+from _discretize import TURRET_DISCRETIZER, legacy_turret_angles
+from _actions import TURRET_ACTIONS, TURRET_ACTION_NAMES
+from _metrics import MetricsLog
+from _seeding import resolve_seed, spawn_seeds, add_argument as add_seed_argument
+from _profiling import NULL_PROFILER, add_arguments as add_profiling_arguments, from_args as profiler_from_args, cprofile
+from _learner import Learner
+from _bullets import BulletPool
 
 # Screen settings
 SCREEN_WIDTH, SCREEN_HEIGHT = 500, 500
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("CQB AI Game")
 
 # Color definitions
 WHITE = (255, 255, 255)
@@ -21,25 +24,26 @@ BULLET_COLOR = (255, 255, 0)
 ENEMY_COLOR = (255, 0, 0)
 
 # Q-learning settings
-MODEL_FILE = './models/targeting.pkl'
-ACTION_SPACE = ['rotate_left', 'rotate_right', 'shoot']
+MODEL_FILE = './models/targeting.qtc'
+METRICS_FILE = './logs/targeting.jsonl'
+LEGACY_MODEL_FILE = './models/targeting.pkl'  # Converted on first load when no checkpoint exists
 ALPHA = 1.0  # Learning rate
 GAMMA = 0.95  # Discount factor
 EPSILON = 1.0  # Initial exploration rate
 EPSILON_MIN = 0.01  # Minimum exploration rate
 EPSILON_DECAY = 0.995  # Decay rate for exploration
 BATCH_SIZE = 256  # Batch size for experience replay
-
-# Experience replay buffer
+REPLAY_RATIO = 1  # Batched replay updates per frame, shared by all players
 REPLAY_BUFFER_SIZE = 100000
-replay_buffer = deque(maxlen=REPLAY_BUFFER_SIZE)
 
-# Load or initialize Q-table
-try:
-    with open(MODEL_FILE, 'rb') as f:
-        q_table = pickle.load(f)
-except FileNotFoundError:
-    q_table = {}  # Initialize empty Q-table
+# Rewards
+REWARD_HIT = 500
+PENALTY_MISS = -10
+
+# Timing settings, counted in simulation steps (the real-time game runs at 60 FPS)
+FPS = 60
+SHOT_COOLDOWN = ms_to_steps(200, FPS)
+EPISODE_LENGTH = ms_to_steps(10000, FPS)
 
 # Bullet settings
 BULLET_SPEED = 20
@@ -52,29 +56,45 @@ VIEW_ANGLE = 90  # The total angle of the player's field of view
 # Player settings
 PLAYER_SIZE = 20
 PLAYER_ROTATION_SPEED = 5  # Rotation speed
+PLAYER_COUNT = 10
+SPAWN_MARGIN = 50  # Closest a player or enemy spawns to the edge of the room
+ENEMY_COUNT = 3
 
 # Text settings
 FONT_SIZE = 36
-font = pygame.font.Font(None, FONT_SIZE)
+
+def load_q_table():
+    q_table = load_checkpointed_q_table(MODEL_FILE, LEGACY_MODEL_FILE, len(TURRET_ACTIONS), TURRET_ACTION_NAMES)
+    if len(q_table) and isinstance(next(q_table.all_states()), tuple):
+        # Older models keyed states by (int(angle / 10),)
+        q_table = TURRET_DISCRETIZER.rekey(q_table, legacy_turret_angles(q_table.all_states()))
+    return q_table
+
+def checkpoint_writer(seed=None):
+    return CheckpointWriter(MODEL_FILE, {'script': 'targeting', 'actions': TURRET_ACTION_NAMES, 'seed': seed})
 
 # Player class
 class Player:
-    def __init__(self, x, y, color, is_ai=False):
+    def __init__(self, x, y, color, learner, clock, is_ai=False, rng=None):
+        self.rng = np.random.default_rng() if rng is None else rng
         self.rect = pygame.Rect(x, y, PLAYER_SIZE, PLAYER_SIZE)
         self.color = color
         self.angle = 0
         self.rotation_speed = PLAYER_ROTATION_SPEED
-        self.bullets = []
+        self.bullets = BulletPool(BULLET_SIZE, SCREEN_WIDTH, SCREEN_HEIGHT, BULLET_COLOR)
         self.is_ai = is_ai
         self.reward = 0
         self.last_shot_time = 0
         self.previous_state = None
         self.previous_action = None
+        self.learner = learner
+        self.q_table = learner.q_table
+        self.clock = clock
+        self.epsilon = EPSILON
 
     def move(self, enemy):
         if self.is_ai:
             self.ai_move(enemy)
-        self.draw(screen)
 
     def ai_move(self, enemy):
         angle_difference = self.angle_to_enemy(enemy)
@@ -84,41 +104,31 @@ class Player:
         current_state = self.extract_state(enemy)
         action = self.choose_action(current_state)
         self.perform_action(action)
+        # Transitions refer to states by their Q-table row
+        current_state = self.q_table.row(current_state)
 
-        # Store experience in replay buffer
+        # Hand the experience to the central learner
         if self.previous_state is not None and self.previous_action is not None:
-            replay_buffer.append((self.previous_state, self.previous_action, self.reward, current_state))
-
-        # Experience replay
-        if len(replay_buffer) >= BATCH_SIZE:
-            for _ in range(10):
-                self.experience_replay()
+            self.learner.observe(self.previous_state, self.previous_action, self.reward, current_state)
 
         self.previous_state = current_state
         self.previous_action = action
 
     def choose_action(self, state):
-        if random.uniform(0, 1) < EPSILON:
-            return random.choice(ACTION_SPACE)  # Explore
+        if self.rng.random() < self.epsilon:
+            return int(self.rng.integers(len(TURRET_ACTIONS)))  # Explore
         else:
             # Exploit: choose the action with the highest Q-value
-            q_values = {action: q_table.get((state, action), 0) for action in ACTION_SPACE}
-            max_q = max(q_values.values())
-            actions_with_max_q = [action for action, q in q_values.items() if q == max_q]
-            return random.choice(actions_with_max_q)
-
-    def perform_action(self, action):
-        if action == 'rotate_left':
-            self.angle = (self.angle - self.rotation_speed) % 360
-        elif action == 'rotate_right':
-            self.angle = (self.angle + self.rotation_speed) % 360
-        elif action == 'shoot':
+            return self.q_table.best_action(state, self.rng)
+
+    def perform_action(self, action_index):
+        _, rotate, shoot = TURRET_ACTIONS[action_index].tolist()
+        self.angle = (self.angle + rotate * self.rotation_speed) % 360
+        if shoot:
             self.shoot()
 
     def extract_state(self, enemy):
-        angle_difference = self.angle_to_enemy(enemy)
-        angle_discrete = int(angle_difference / 10)
-        return (angle_discrete,)
+        return TURRET_DISCRETIZER.state((self.angle_to_enemy(enemy),))
 
     def angle_to_enemy(self, enemy):
         dx = enemy.rect.centerx - self.rect.centerx
@@ -130,35 +140,21 @@ class Player:
         return angle_difference
 
     def shoot(self):
-        current_time = pygame.time.get_ticks()
-        if current_time - self.last_shot_time > 200:  # Cooldown
+        current_time = self.clock.ticks
+        if current_time - self.last_shot_time > SHOT_COOLDOWN:
             angle_rad = math.radians(self.angle)
             bullet_dx = BULLET_SPEED * math.cos(angle_rad)
             bullet_dy = BULLET_SPEED * math.sin(angle_rad)
-            bullet = Bullet(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy, BULLET_COLOR)
-            self.bullets.append(bullet)
+            self.bullets.spawn(self.rect.centerx, self.rect.centery, bullet_dx, bullet_dy)
             self.last_shot_time = current_time
 
     def update_bullets(self, enemies):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            if bullet.is_off_screen():
-                self.bullets.remove(bullet)
-                if self.is_ai:
-                    self.reward -= 10  # Penalty for missing a shot
-            else:
-                for enemy in enemies:
-                    if bullet.rect.colliderect(enemy.rect):
-                        self.bullets.remove(bullet)
-                        if self.is_ai:
-                            self.reward += 500  # Reward for hitting the enemy
-
-    def experience_replay(self):
-        batch = random.sample(replay_buffer, BATCH_SIZE)
-        for previous_state, action, reward, current_state in batch:
-            best_future_q = max(q_table.get((current_state, a), 0) for a in ACTION_SPACE)
-            old_q = q_table.get((previous_state, action), 0)
-            q_table[(previous_state, action)] = old_q + ALPHA * (reward + GAMMA * best_future_q - old_q)
+        if not self.bullets:
+            return
+        off_screen, _, hit_enemy = self.bullets.step([enemy.rect for enemy in enemies])
+        if self.is_ai:
+            self.reward += PENALTY_MISS * int(off_screen.sum())
+            self.reward += REWARD_HIT * int((hit_enemy >= 0).sum())
 
     def draw(self, surface):
         # Draw the viewing area
@@ -173,26 +169,7 @@ class Player:
         pygame.draw.polygon(viewing_surface, (0, 255, 0, 20), points, 0)
         surface.blit(viewing_surface, (0, 0))
         pygame.draw.rect(surface, self.color, self.rect)
-        for bullet in self.bullets:
-            bullet.draw(surface)
-
-# Bullet class
-class Bullet:
-    def __init__(self, x, y, dx, dy, color):
-        self.rect = pygame.Rect(x, y, BULLET_SIZE, BULLET_SIZE)
-        self.dx = dx
-        self.dy = dy
-        self.color = color
-
-    def move(self):
-        self.rect.x += round(self.dx)
-        self.rect.y += round(self.dy)
-
-    def is_off_screen(self):
-        return not (0 <= self.rect.x <= SCREEN_WIDTH and 0 <= self.rect.y <= SCREEN_HEIGHT)
-
-    def draw(self, surface):
-        pygame.draw.rect(surface, self.color, self.rect)
+        self.bullets.draw(surface)
 
 # Enemy class
 class Enemy:
@@ -203,53 +180,183 @@ class Enemy:
     def draw(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
 
-# Create AI players and enemies
-players = [Player(random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50), PLAYER_COLOR, is_ai=True) for _ in range(10)]
-enemies = [Enemy(random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50), ENEMY_COLOR) for _ in range(3)]
-
-# Main game loop
-clock = pygame.time.Clock()
-game_start_time = pygame.time.get_ticks()
-total_rewards = []
-
-while True:
-    # Reset game after 10 seconds
-    if pygame.time.get_ticks() - game_start_time > 10000:
-        best_player = max(players, key=lambda p: p.reward)
-        total_rewards.append(round(best_player.reward))
-        with open(MODEL_FILE, 'wb') as f:
-            pickle.dump(q_table, f)
-        print(f'Game Over. Best Player Total Reward: {best_player.reward}')
-        game_start_time = pygame.time.get_ticks()
-        for player in players:
+def random_position(rng):
+    x = int(rng.integers(SPAWN_MARGIN, SCREEN_WIDTH - SPAWN_MARGIN, endpoint=True))
+    y = int(rng.integers(SPAWN_MARGIN, SCREEN_HEIGHT - SPAWN_MARGIN, endpoint=True))
+    return x, y
+
+def create_enemies(rng, count=ENEMY_COUNT):
+    return [Enemy(*random_position(rng), ENEMY_COLOR) for _ in range(count)]
+
+# Arena class
+class Arena:
+    """The open room with the AI players and their enemies, advanced one step at a time.
+
+    All random draws of the arena and its players come from one generator seeded with `seed`.
+    """
+    def __init__(self, learner, player_count=PLAYER_COUNT, enemy_count=ENEMY_COUNT, profiler=NULL_PROFILER,
+                 seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.learner = learner
+        self.profiler = profiler
+        self.enemy_count = enemy_count
+        self.clock = StepClock()
+        self.epsilon = EPSILON
+        self.players = [Player(*random_position(self.rng), PLAYER_COLOR, learner, self.clock, is_ai=True, rng=self.rng)
+                        for _ in range(player_count)]
+        self.enemies = create_enemies(self.rng, enemy_count)
+        self.game_start_time = self.clock.ticks
+
+    def best_player(self):
+        return max(self.players, key=lambda p: p.reward)
+
+    def is_game_over(self):
+        return self.clock.ticks - self.game_start_time > EPISODE_LENGTH
+
+    def reset(self):
+        self.game_start_time = self.clock.ticks
+        self.epsilon = max(EPSILON_MIN, self.epsilon * EPSILON_DECAY)  # Decay epsilon
+        for player in self.players:
             player.reward = 0  # Reset reward after game end
-            player.rect.x, player.rect.y = random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50)
-        enemies = [Enemy(random.randint(50, SCREEN_WIDTH - 50), random.randint(50, SCREEN_HEIGHT - 50), ENEMY_COLOR) for _ in range(3)]
-        EPSILON = max(EPSILON_MIN, EPSILON * EPSILON_DECAY)  # Decay epsilon
-        continue
-
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            with open(MODEL_FILE, 'wb') as f:
-                pickle.dump(q_table, f)
-            pygame.quit()
-            sys.exit()
-
-    # Update game state
-    for player in players:
-        player.move(random.choice(enemies))
-        player.update_bullets(enemies)
-
-    # Draw
-    screen.fill(WHITE)
-    for player in players:
-        player.draw(screen)
-    for enemy in enemies:
-        enemy.draw(screen)
-
-    best_player = max(players, key=lambda p: p.reward)
-    reward_text = font.render(f"Best Player Reward: {best_player.reward}", True, (0, 0, 0))
-    screen.blit(reward_text, (5, 40))
-
-    pygame.display.flip()
-    clock.tick(60)  # FPS
\ No newline at end of file
+            player.rect.x, player.rect.y = random_position(self.rng)
+            player.epsilon = self.epsilon
+        self.enemies = create_enemies(self.rng, self.enemy_count)
+
+    def step(self):
+        profiler = self.profiler
+        # Every player tracks a randomly chosen enemy this step
+        targets = self.rng.integers(len(self.enemies), size=len(self.players)).tolist()
+        for player, target in zip(self.players, targets):
+            with profiler.phase('move'):
+                player.move(self.enemies[target])
+            with profiler.phase('update_bullets'):
+                player.update_bullets(self.enemies)
+        with profiler.phase('experience_replay'):
+            self.learner.step()
+        self.clock.tick()
+
+# Renderer class
+class Renderer:
+    """Opens the window on creation and draws the arena every `every` steps."""
+    def __init__(self, every=1):
+        pygame.init()
+        self.every = every
+        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("CQB AI Game")
+        self.font = pygame.font.Font(None, FONT_SIZE)
+        self.clock = pygame.time.Clock()
+        self.profiler = NULL_PROFILER
+
+    def handle_events(self):
+        # Returns False once the window has been closed
+        return not any(event.type == pygame.QUIT for event in pygame.event.get())
+
+    def draw(self, arena):
+        screen = self.screen
+        screen.fill(WHITE)
+        for player in arena.players:
+            player.draw(screen)
+        for enemy in arena.enemies:
+            enemy.draw(screen)
+
+        best_player = arena.best_player()
+        reward_text = self.font.render(f"Best Player Reward: {best_player.reward}", True, (0, 0, 0))
+        screen.blit(reward_text, (5, 40))
+
+        with self.profiler.phase('display_flip'):
+            pygame.display.flip()
+        # Only cap the frame rate when every step is shown, otherwise train at full speed
+        if self.every == 1:
+            self.clock.tick(FPS)
+
+# Trainer class
+class Trainer:
+    """Runs the arena game after game, saving the Q-table and logging metrics between games."""
+    def __init__(self, arena, checkpoints, metrics, renderer=None):
+        self.arena = arena
+        self.checkpoints = checkpoints
+        self.metrics = metrics
+        self.renderer = renderer
+
+    def end_game(self):
+        arena = self.arena
+        best_player = arena.best_player()
+        rewards = [player.reward for player in arena.players]
+        self.metrics.log(steps=arena.clock.ticks, episode_steps=arena.clock.ticks - arena.game_start_time,
+                         best_reward=best_player.reward, mean_reward=sum(rewards) / len(rewards),
+                         epsilon=arena.epsilon, q_table_states=len(arena.learner.q_table))
+        with self.arena.profiler.phase('checkpoint'):
+            self.checkpoints.save(self.arena.learner.q_table)
+        print(f'Game Over. Best Player Total Reward: {best_player.reward}')
+        self.arena.reset()
+
+    def run(self, max_steps=None):
+        arena = self.arena
+        renderer = self.renderer
+        while max_steps is None or arena.clock.ticks < max_steps:
+            # Reset game after 10 seconds
+            if arena.is_game_over():
+                self.end_game()
+                continue
+
+            render = renderer is not None and arena.clock.ticks % renderer.every == 0
+            if render and not renderer.handle_events():
+                break
+
+            arena.step()
+
+            if render:
+                with arena.profiler.phase('render'):
+                    renderer.draw(arena)
+            arena.profiler.step()
+
+def main(headless=False, render_every=1, max_steps=None, profiler=NULL_PROFILER, metrics_path=METRICS_FILE,
+         seed=None):
+    seed = resolve_seed(seed)
+    print(f'Seed: {seed}')
+    arena_seed, replay_seed = spawn_seeds(seed, 2)
+    # Central learner collecting every player's experience into one replay buffer
+    learner = Learner(load_q_table(), REPLAY_BUFFER_SIZE, BATCH_SIZE, REPLAY_RATIO, ALPHA, GAMMA,
+                      np.random.default_rng(replay_seed))
+    renderer = None if headless else Renderer(render_every)
+    if renderer is not None:
+        renderer.profiler = profiler
+    arena = Arena(learner, profiler=profiler, seed=arena_seed)
+    profiler.watch('q_table_states', lambda: len(learner.q_table))
+    profiler.watch('replay_fill', lambda: round(len(learner.replay_buffer) / learner.replay_buffer.capacity, 4))
+    profiler.watch('replay_updates', lambda: learner.updates)
+    profiler.watch('epsilon', lambda: round(arena.epsilon, 4))
+    checkpoints = checkpoint_writer(seed)
+    metrics = MetricsLog(metrics_path)
+    trainer = Trainer(arena, checkpoints, metrics, renderer)
+    try:
+        trainer.run(max_steps)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        profiler.close()
+        metrics.close()
+    checkpoints.save(learner.q_table)
+    checkpoints.close()
+    pygame.quit()
+    sys.exit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CQB target tracking with Q-Learning and experience replay")
+    parser.add_argument('--headless', action='store_true',
+                        help='train without a window, rendering or frame cap')
+    parser.add_argument('--render-every', type=int, default=1,
+                        help='draw one frame every N steps; the FPS cap only applies when N is 1')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='stop after this many steps and save the model')
+    add_seed_argument(parser)
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='append one JSON line of episode metrics per game to this file')
+    add_profiling_arguments(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with cprofile(args.profile):
+        main(headless=args.headless, render_every=args.render_every, max_steps=args.steps,
+             profiler=profiler_from_args(args), metrics_path=args.metrics, seed=args.seed)
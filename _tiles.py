@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+
+from _qtable import best_of
+from _checkpoint import atomic_write
+
+N_TILINGS = 8
+TILE_RESOLUTION = 8     # Tiles across each feature's range in one tiling
+TABLE_SIZE = 1 << 16    # Rows of the hashed weight table
+HASH_SEED = 0x5EED      # Fixes the hash, so a saved weight table stays valid across runs
+
+
+class TileCoder:
+    """Hashed tile coding of feature vectors into `n_tilings` rows of a fixed-size weight table.
+
+    Each tiling splits every feature's [low, high] range into `resolution` tiles and is offset from the
+    others by uneven fractions of a tile, so nearby observations share most of their tiles. The tile
+    coordinates of every tiling are hashed into [0, table_size), which bounds memory however many
+    distinct cells are visited. `tiles` works on one observation or an (n, n_features) batch at once.
+    """
+    def __init__(self, low, high, n_tilings=N_TILINGS, resolution=TILE_RESOLUTION, table_size=TABLE_SIZE):
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.n_tilings = n_tilings
+        self.resolution = resolution
+        self.table_size = table_size
+        n_features = len(self.low)
+        self.scale = resolution / (self.high - self.low)
+        # Tiling t is shifted by t * (2d + 1) / n_tilings of a tile along feature d, the usual
+        # asymmetric displacement that keeps the tilings from lining up diagonally
+        self.offsets = (np.arange(n_tilings)[:, None] * (2 * np.arange(n_features) + 1) / n_tilings) % 1
+        rng = np.random.default_rng(HASH_SEED)
+        self.multipliers = rng.integers(1, 1 << 62, size=n_features, dtype=np.int64) | 1
+        self.tiling_salt = rng.integers(1, 1 << 62, size=n_tilings, dtype=np.int64)
+
+    def tiles(self, features):
+        # (..., n_tilings) weight-table rows of (..., n_features) features
+        scaled = (np.clip(features, self.low, self.high) - self.low) * self.scale
+        coords = np.floor(scaled[..., None, :] + self.offsets).astype(np.int64)
+        # Integer overflow wraps around here, which is all the hash needs
+        hashed = (coords * self.multipliers).sum(axis=-1) + self.tiling_salt
+        return hashed % self.table_size
+
+
+class TileQFunction:
+    """Linear Q-function over the tiles of a TileCoder: Q(s, a) is the sum of the weights of s's tiles.
+
+    `best_action` and `update` take the same arguments as the QTable methods, with observation vectors
+    in place of state ids, so a player can use either. The step size is split across the tilings.
+    """
+    def __init__(self, coder, n_actions):
+        self.coder = coder
+        self.n_actions = n_actions
+        self.weights = np.zeros((coder.table_size, n_actions), dtype=np.float32)
+        self.updates = 0
+
+    def q_values(self, observations):
+        # (n, n_actions) Q-values of an (n, n_features) batch
+        return self.weights[self.coder.tiles(observations)].sum(axis=-2)
+
+    def best_actions(self, observations):
+        return self.q_values(observations).argmax(axis=1)
+
+    def best_action(self, observation, rng):
+        return best_of(self.weights[self.coder.tiles(observation)].sum(axis=0).tolist(), rng)
+
+    def update(self, observation, action, reward, next_observation, alpha, gamma):
+        tiles = self.coder.tiles(observation)
+        max_next_q = self.weights[self.coder.tiles(next_observation)].sum(axis=0).max()
+        q = self.weights[tiles, action].sum()
+        self.weights[tiles, action] += alpha / self.coder.n_tilings * (reward + gamma * max_next_q - q)
+        self.updates += 1
+
+    def update_batch(self, observations, actions, rewards, next_observations, alpha, gamma):
+        # TD updates of a batch computed from the same weights; shared tiles accumulate every update
+        tiles = self.coder.tiles(observations)
+        max_next_q = self.q_values(next_observations).max(axis=1)
+        q = self.weights[tiles, actions[:, None]].sum(axis=1)
+        errors = alpha / self.coder.n_tilings * (rewards + gamma * max_next_q - q)
+        np.add.at(self.weights, (tiles, actions[:, None]), errors[:, None].astype(np.float32))
+        self.updates += len(actions)
+
+
+def save_tiles(path, q_function, metadata=None):
+    coder = q_function.coder
+    with atomic_write(path) as f:
+        np.savez(f, weights=q_function.weights, low=coder.low, high=coder.high,
+                 config=np.array([coder.n_tilings, coder.resolution, coder.table_size, q_function.updates]),
+                 metadata=np.array(json.dumps(metadata or {})))
+
+
+def load_tiles(path):
+    with np.load(path) as arrays:
+        n_tilings, resolution, table_size, updates = arrays['config'].tolist()
+        coder = TileCoder(arrays['low'], arrays['high'], n_tilings, resolution, table_size)
+        q_function = TileQFunction(coder, arrays['weights'].shape[1])
+        q_function.weights = arrays['weights']
+    q_function.updates = updates
+    return q_function
@@ -0,0 +1,264 @@
+import sys
+import argparse
+
+import numpy as np
+
+from _clock import StepClock
+from _discretize import TURRET_DISCRETIZER
+from _actions import TURRET_ACTIONS, ROTATE, SHOOT
+# The arenas are the _targeting.py room, so they share its settings
+from _targeting import (SCREEN_WIDTH, SCREEN_HEIGHT, SPAWN_MARGIN, PLAYER_SIZE, BULLET_SIZE, BULLET_SPEED,
+                        VIEW_DISTANCE, VIEW_ANGLE, PLAYER_ROTATION_SPEED, SHOT_COOLDOWN, REWARD_HIT, PENALTY_MISS,
+                        EPISODE_LENGTH, ALPHA, GAMMA, EPSILON, EPSILON_MIN, EPSILON_DECAY, BATCH_SIZE,
+                        REPLAY_RATIO, REPLAY_BUFFER_SIZE, load_q_table, checkpoint_writer)
+from _learner import Learner
+from _metrics import MetricsLog
+from _seeding import resolve_seed, spawn_seeds, add_argument as add_seed_argument
+
+BULLET_SLOTS = 8  # Live bullets per agent; the cooldown keeps far fewer in flight
+N_ENVS = 1024
+METRICS_FILE = './logs/targeting_vector.jsonl'
+
+
+class VectorEnv:
+    """N independent arenas, each with one turret agent and M static enemies, stepped as arrays.
+
+    Positions follow pygame.Rect conventions: (x, y) is the integer top-left corner. An arena's episode
+    ends once it has run for the _targeting.py EPISODE_LENGTH, and the arena is reset within that step.
+    """
+    def __init__(self, n_envs, n_enemies=3, walls=(), seed=None):
+        self.n_envs = n_envs
+        self.n_enemies = n_enemies
+        self.rng = np.random.default_rng(seed)
+        self.clock = StepClock()
+        # Walls as (x, y, width, height) rows, shared by every arena
+        self.walls = np.asarray(walls, dtype=np.int64).reshape(-1, 4)
+
+        self.player_x = np.zeros(n_envs, dtype=np.int64)
+        self.player_y = np.zeros(n_envs, dtype=np.int64)
+        self.angle = np.zeros(n_envs, dtype=np.int64)
+        self.last_shot_time = np.zeros(n_envs, dtype=np.int64)
+        self.start_time = np.zeros(n_envs, dtype=np.int64)
+        self.reward = np.zeros(n_envs, dtype=np.float64)  # Total reward of each arena's current episode
+        self.episode_rewards = np.zeros(0, dtype=np.float64)  # Totals of the episodes the last step ended
+        self.enemy_x = np.zeros((n_envs, n_enemies), dtype=np.int64)
+        self.enemy_y = np.zeros((n_envs, n_enemies), dtype=np.int64)
+        self.target = np.zeros(n_envs, dtype=np.int64)
+
+        self.bullet_x = np.zeros((n_envs, BULLET_SLOTS), dtype=np.int64)
+        self.bullet_y = np.zeros((n_envs, BULLET_SLOTS), dtype=np.int64)
+        self.bullet_dx = np.zeros((n_envs, BULLET_SLOTS), dtype=np.int64)
+        self.bullet_dy = np.zeros((n_envs, BULLET_SLOTS), dtype=np.int64)
+        self.bullet_alive = np.zeros((n_envs, BULLET_SLOTS), dtype=bool)
+        self.reset()
+
+    def _spawn(self, shape):
+        x = self.rng.integers(SPAWN_MARGIN, SCREEN_WIDTH - SPAWN_MARGIN, size=shape, endpoint=True)
+        y = self.rng.integers(SPAWN_MARGIN, SCREEN_HEIGHT - SPAWN_MARGIN, size=shape, endpoint=True)
+        return x, y
+
+    def reset(self, mask=None):
+        # Reset every arena, or only those selected by a boolean mask
+        if mask is None:
+            mask = np.ones(self.n_envs, dtype=bool)
+        n = int(mask.sum())
+        self.player_x[mask], self.player_y[mask] = self._spawn(n)
+        self.enemy_x[mask], self.enemy_y[mask] = self._spawn((n, self.n_enemies))
+        self.angle[mask] = 0
+        self.last_shot_time[mask] = self.clock.ticks - SHOT_COOLDOWN - 1
+        self.start_time[mask] = self.clock.ticks
+        self.reward[mask] = 0
+        self.bullet_alive[mask] = False
+        self.target[mask] = self.rng.integers(0, self.n_enemies, size=n)
+
+    def choose_targets(self):
+        # Each arena's agent tracks one randomly chosen enemy per step
+        self.target = self.rng.integers(0, self.n_enemies, size=self.n_envs)
+
+    def _enemy_deltas(self):
+        center_x = self.player_x + PLAYER_SIZE // 2
+        center_y = self.player_y + PLAYER_SIZE // 2
+        dx = self.enemy_x + PLAYER_SIZE // 2 - center_x[:, None]
+        dy = self.enemy_y + PLAYER_SIZE // 2 - center_y[:, None]
+        return dx, dy
+
+    def angle_to_enemy(self):
+        # Unsigned angle in [0, 180] between each agent's heading and each enemy, shape (N, M)
+        dx, dy = self._enemy_deltas()
+        bearing = np.degrees(np.arctan2(dy, dx)) % 360
+        difference = (bearing - self.angle[:, None] + 360) % 360
+        return np.where(difference > 180, 360 - difference, difference)
+
+    def distance_to(self):
+        dx, dy = self._enemy_deltas()
+        return np.hypot(dx, dy)
+
+    def is_enemy_in_view(self):
+        return (self.angle_to_enemy() <= VIEW_ANGLE / 2) & (self.distance_to() <= VIEW_DISTANCE)
+
+    def target_angle(self):
+        rows = np.arange(self.n_envs)
+        return self.angle_to_enemy()[rows, self.target]
+
+    def states(self):
+        # Discretized angle to the tracked enemy, as in _targeting.py Player.extract_state
+        return TURRET_DISCRETIZER.states(self.target_angle()[:, None])
+
+    def step(self, actions):
+        """Apply one action per arena and advance all arenas by one step.
+
+        Returns the state each arena ended the step in, its reward for the step and whether its episode
+        ended. Arenas whose episode ended are reset, so `states()` then gives their first state.
+        """
+        actions = TURRET_ACTIONS[actions]
+        # Reward increases as the angle to the tracked enemy decreases
+        step_reward = (180 - self.target_angle()) / 180
+
+        self.angle += actions[:, ROTATE] * PLAYER_ROTATION_SPEED
+        self.angle %= 360
+        self._shoot(actions[:, SHOOT] == 1)
+
+        hits, misses = self._update_bullets()
+        step_reward += REWARD_HIT * hits + PENALTY_MISS * misses
+        self.reward += step_reward
+        self.clock.tick()
+        self.choose_targets()
+        states = self.states()
+        dones = self.clock.ticks - self.start_time > EPISODE_LENGTH
+        self.episode_rewards = self.reward[dones]
+        if dones.any():
+            self.reset(dones)
+        return states, step_reward, dones
+
+    def _shoot(self, wants_to_shoot):
+        free_slot = np.argmin(self.bullet_alive, axis=1)
+        has_slot = ~self.bullet_alive[np.arange(self.n_envs), free_slot]
+        ready = self.clock.ticks - self.last_shot_time > SHOT_COOLDOWN
+        shooters = np.flatnonzero(wants_to_shoot & ready & has_slot)
+        if not len(shooters):
+            return
+        slots = free_slot[shooters]
+        angle_rad = np.radians(self.angle[shooters])
+        self.bullet_x[shooters, slots] = self.player_x[shooters] + PLAYER_SIZE // 2
+        self.bullet_y[shooters, slots] = self.player_y[shooters] + PLAYER_SIZE // 2
+        self.bullet_dx[shooters, slots] = np.rint(BULLET_SPEED * np.cos(angle_rad))
+        self.bullet_dy[shooters, slots] = np.rint(BULLET_SPEED * np.sin(angle_rad))
+        self.bullet_alive[shooters, slots] = True
+        self.last_shot_time[shooters] = self.clock.ticks
+
+    def _update_bullets(self):
+        alive = self.bullet_alive
+        self.bullet_x += np.where(alive, self.bullet_dx, 0)
+        self.bullet_y += np.where(alive, self.bullet_dy, 0)
+        x, y = self.bullet_x, self.bullet_y
+
+        off_screen = alive & ~((0 <= x) & (x <= SCREEN_WIDTH) & (0 <= y) & (y <= SCREEN_HEIGHT))
+        in_wall = np.zeros_like(alive)
+        for wall_x, wall_y, wall_w, wall_h in self.walls:
+            in_wall |= _overlaps(x, y, BULLET_SIZE, BULLET_SIZE, wall_x, wall_y, wall_w, wall_h)
+        missed = off_screen | (alive & in_wall)
+
+        # Bullets (N, B) against enemies (N, M)
+        hit_any = _overlaps(
+            x[:, :, None], y[:, :, None], BULLET_SIZE, BULLET_SIZE,
+            self.enemy_x[:, None, :], self.enemy_y[:, None, :], PLAYER_SIZE, PLAYER_SIZE,
+        ).any(axis=2)
+        hit = alive & ~missed & hit_any
+
+        self.bullet_alive = alive & ~missed & ~hit
+        return hit.sum(axis=1), missed.sum(axis=1)
+
+
+def _overlaps(ax, ay, aw, ah, bx, by, bw, bh):
+    # pygame.Rect.colliderect for arrays of rectangles
+    return (ax < bx + bw) & (bx < ax + aw) & (ay < by + bh) & (by < ay + ah)
+
+
+class VectorTrainer:
+    """Trains one Q-table on a VectorEnv, all arenas acting epsilon-greedily on it at every step.
+
+    Each step's transitions go to the central Learner's replay buffer as one batch, and the learner runs
+    its replay updates once per step, as it does for the players of one _targeting.py arena.
+    """
+    def __init__(self, env, learner, checkpoints, metrics, rng=None):
+        self.env = env
+        self.learner = learner
+        self.checkpoints = checkpoints
+        self.metrics = metrics
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.epsilon = EPSILON
+
+    def rows(self, states):
+        q_table = self.learner.q_table
+        return np.fromiter((q_table.row(state) for state in states.tolist()), dtype=np.int64, count=len(states))
+
+    def choose_actions(self, rows):
+        q_values = self.learner.q_table.values[rows]
+        # Greedy with ties broken at random: random scores, kept only where an action is the best
+        best = q_values == q_values.max(axis=1, keepdims=True)
+        actions = (self.rng.random(q_values.shape) * best).argmax(axis=1)
+        explore = self.rng.random(len(rows)) < self.epsilon
+        actions[explore] = self.rng.integers(q_values.shape[1], size=int(explore.sum()))
+        return actions
+
+    def step(self):
+        env = self.env
+        rows = self.rows(env.states())
+        actions = self.choose_actions(rows)
+        next_states, rewards, dones = env.step(actions)
+        self.learner.observe_batch(rows, actions, rewards, self.rows(next_states))
+        self.learner.step()
+        if dones.any():
+            self.end_games()
+
+    def end_games(self):
+        env = self.env
+        rewards = env.episode_rewards
+        self.metrics.log(steps=env.clock.ticks, arenas=len(rewards), best_reward=float(rewards.max()),
+                         mean_reward=float(rewards.mean()), epsilon=self.epsilon,
+                         q_table_states=len(self.learner.q_table))
+        self.checkpoints.save(self.learner.q_table)
+        self.epsilon = max(EPSILON_MIN, self.epsilon * EPSILON_DECAY)
+        print(f'Game Over. Best Arena Total Reward: {rewards.max():.1f}')
+
+    def run(self, max_steps=None):
+        while max_steps is None or self.env.clock.ticks < max_steps:
+            self.step()
+
+
+def main(n_envs=N_ENVS, max_steps=None, metrics_path=METRICS_FILE, seed=None):
+    seed = resolve_seed(seed)
+    print(f'Seed: {seed}')
+    env_seed, replay_seed, policy_seed = spawn_seeds(seed, 3)
+    learner = Learner(load_q_table(), REPLAY_BUFFER_SIZE, BATCH_SIZE, REPLAY_RATIO, ALPHA, GAMMA,
+                      np.random.default_rng(replay_seed))
+    checkpoints = checkpoint_writer(seed)
+    metrics = MetricsLog(metrics_path)
+    trainer = VectorTrainer(VectorEnv(n_envs, seed=env_seed), learner, checkpoints, metrics,
+                            np.random.default_rng(policy_seed))
+    try:
+        trainer.run(max_steps)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        metrics.close()
+    checkpoints.save(learner.q_table)
+    checkpoints.close()
+    sys.exit()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the _targeting.py turret Q-table on many arenas at once")
+    parser.add_argument('--envs', type=int, default=N_ENVS,
+                        help='arenas stepped together, each with one turret agent')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='stop after this many steps of all arenas and save the model')
+    add_seed_argument(parser)
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='append one JSON line of episode metrics per finished game to this file')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(n_envs=args.envs, max_steps=args.steps, metrics_path=args.metrics, seed=args.seed)
@@ -0,0 +1,41 @@
+import random
+
+import numpy as np
+import pygame
+
+import _bullets
+from _bullets import BulletPool
+from _spatial import WallIndex
+
+WIDTH, HEIGHT = 800, 600
+
+
+def random_walls(rng, count):
+    return [pygame.Rect(rng.randrange(WIDTH), rng.randrange(HEIGHT), rng.randrange(5, 60), rng.randrange(5, 60))
+            for _ in range(count)]
+
+
+def test_scalar_and_vector_steps_match(monkeypatch):
+    rng = random.Random(0)
+    for trial in range(300):
+        pools = [BulletPool(5, WIDTH, HEIGHT, (0, 0, 0)) for _ in range(2)]
+        for _ in range(rng.randrange(1, 40)):
+            shot = (rng.randrange(-10, WIDTH + 10), rng.randrange(-10, HEIGHT + 10),
+                    rng.uniform(-20, 20), rng.uniform(-20, 20))
+            for pool in pools:
+                pool.spawn(*shot)
+        enemies = [pygame.Rect(rng.randrange(WIDTH), rng.randrange(HEIGHT), 20, 20) for _ in range(rng.randrange(4))]
+        walls = WallIndex(random_walls(rng, 20)) if trial % 2 else None
+        for _ in range(5):
+            results = []
+            for pool, scalar_bullets in zip(pools, (_bullets.BULLET_CAPACITY + 1, 0)):
+                monkeypatch.setattr(_bullets, 'SCALAR_BULLETS', scalar_bullets)
+                results.append(pool.step(enemies, walls))
+            for scalar, vector in zip(*results):
+                assert scalar.dtype == vector.dtype
+                assert scalar.tolist() == vector.tolist()
+            scalar_pool, vector_pool = pools
+            assert scalar_pool.count == vector_pool.count
+            for column in ('x', 'y', 'dx', 'dy'):
+                n = scalar_pool.count
+                assert np.array_equal(getattr(scalar_pool, column)[:n], getattr(vector_pool, column)[:n])
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from _qtable import QTable, BoundedQTable
+from _checkpoint import save_checkpoint, append_delta, load_checkpoint, read_header, delta_path, CheckpointWriter
+
+N_ACTIONS = 3
+
+
+def filled_table(n_states, table=None):
+    table = QTable(N_ACTIONS) if table is None else table
+    for i in range(n_states):
+        table.values[table.row((i, i % 7))] = [i, -i, 0.5 * i]
+    return table
+
+
+def append_dirty(path, q_table):
+    rows = q_table.take_dirty()
+    append_delta(path, read_header(path)['checkpoint_id'], q_table.row_keys(rows), q_table.values[rows])
+
+
+def test_delta_round_trip(tmp_path):
+    path = str(tmp_path / 'model.qtc')
+    q_table = filled_table(100)
+    save_checkpoint(path, q_table)
+    q_table.take_dirty()
+
+    q_table.update((3, 3), 1, 10.0, (4, 4), 0.5, 0.9)
+    q_table.update((500, 1), 2, 1.0, (3, 3), 0.5, 0.9)
+    append_dirty(path, q_table)
+
+    loaded, _ = load_checkpoint(path)
+    assert loaded.to_dict() == q_table.to_dict()
+
+
+def test_truncated_delta_tail_is_dropped(tmp_path):
+    path = str(tmp_path / 'model.qtc')
+    q_table = filled_table(100)
+    save_checkpoint(path, q_table)
+    q_table.take_dirty()
+
+    q_table.update((500, 1), 2, 1.0, (3, 3), 0.5, 0.9)
+    append_dirty(path, q_table)
+    expected = q_table.to_dict()
+    q_table.update((501, 2), 0, -1.0, (3, 3), 0.5, 0.9)
+    append_dirty(path, q_table)
+
+    # A crash in the middle of the second append
+    size = os.path.getsize(delta_path(path))
+    with open(delta_path(path), 'r+b') as f:
+        f.truncate(size - 5)
+
+    loaded, _ = load_checkpoint(path)
+    assert loaded.to_dict() == expected
+
+
+def test_eviction_writes_full_snapshot(tmp_path):
+    path = str(tmp_path / 'model.qtc')
+    q_table = BoundedQTable(N_ACTIONS, max_states=50)
+    rng = np.random.default_rng(0)
+    writer = CheckpointWriter(path)
+    for i in range(40):
+        q_table.update((i, 0), 0, 1.0, (i + 1, 0), 0.1, 0.9)
+    writer.save(q_table)
+    for i in range(40, 80):
+        q_table.update((i, 0), int(rng.integers(N_ACTIONS)), 1.0, (i + 1, 0), 0.1, 0.9)
+    assert q_table.evicted
+    writer.save(q_table)
+    writer.close()
+
+    # Deltas cannot remove states, so the evicted ones must be gone from the saved table
+    assert not os.path.exists(delta_path(path))
+    loaded, _ = load_checkpoint(path)
+    assert loaded.to_dict() == q_table.to_dict()
+    assert (0, 0) not in loaded
@@ -0,0 +1,55 @@
+import numpy as np
+
+from _qtable import QTable
+from _discretize import Discretizer, uniform_edges, TURRET_DISCRETIZER, legacy_turret_angles
+
+SCREEN_WIDTH, SCREEN_HEIGHT = 800, 600
+
+# The normalized position features of _game.py, with the angle and a count after them
+POSITION_DISCRETIZER = Discretizer([uniform_edges(0, 1, 0.01), uniform_edges(0, 1, 0.01),
+                                    uniform_edges(0, 1, 0.01), uniform_edges(0, 10, 1)])
+
+
+def screen_positions():
+    # Every pixel column and row, normalized as Player.features does; many land exactly on an edge
+    x = np.arange(SCREEN_WIDTH + 1) / SCREEN_WIDTH
+    y = np.arange(SCREEN_HEIGHT + 1) / SCREEN_HEIGHT
+    n = max(len(x), len(y))
+    features = np.zeros((n, 4))
+    features[:, 0] = np.resize(x, n)
+    features[:, 1] = np.resize(y, n)
+    features[:, 2] = np.linspace(-0.1, 1.1, n)
+    features[:, 3] = np.arange(n) % 12
+    return features
+
+
+def digitized_states(discretizer, features):
+    bins = np.stack([np.digitize(features[:, i], edges) for i, edges in enumerate(discretizer.edges)], axis=1)
+    return bins @ discretizer.strides
+
+
+def test_batch_matches_single_on_screen_grid():
+    features = screen_positions()
+    states = POSITION_DISCRETIZER.states(features)
+    assert states.tolist() == [POSITION_DISCRETIZER.state(tuple(row)) for row in features.tolist()]
+    assert states.tolist() == digitized_states(POSITION_DISCRETIZER, features).tolist()
+
+
+def test_batch_matches_single_on_turret_angles():
+    rng = np.random.default_rng(0)
+    angles = np.concatenate([np.arange(-190, 191, 5), rng.uniform(-180, 180, 1000)])[:, None].astype(np.float64)
+    states = TURRET_DISCRETIZER.states(angles)
+    assert states.tolist() == [TURRET_DISCRETIZER.state((angle,)) for angle in angles[:, 0].tolist()]
+    assert states.tolist() == digitized_states(TURRET_DISCRETIZER, angles).tolist()
+
+
+def test_legacy_turret_states_keep_their_own_bins():
+    # Every int(angle / 10) key of older models must land in a distinct state, or rekey drops rows
+    legacy = [(k,) for k in range(-18, 19)]
+    states = TURRET_DISCRETIZER.states(legacy_turret_angles(legacy)[:, None]).tolist()
+    assert len(set(states)) == len(legacy)
+    q_table = QTable(2)
+    for k, in legacy:
+        q_table.values[q_table.row((k,))] = [k, -k]
+    rekeyed = TURRET_DISCRETIZER.rekey(q_table, legacy_turret_angles(legacy))
+    assert sorted(rekeyed.to_dict().values()) == sorted(q_table.to_dict().values())
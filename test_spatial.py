@@ -0,0 +1,39 @@
+import random
+
+import numpy as np
+import pygame
+
+from _spatial import WallIndex, LINEAR_SCAN_WALLS
+
+WIDTH, HEIGHT = 800, 600
+
+
+def random_rects(rng, count, max_size):
+    return [pygame.Rect(rng.randrange(-40, WIDTH), rng.randrange(-40, HEIGHT),
+                        rng.randrange(1, max_size), rng.randrange(1, max_size)) for _ in range(count)]
+
+
+def test_query_matches_linear_scan():
+    rng = random.Random(0)
+    # Both sides of the linear-scan threshold
+    for n_walls in (LINEAR_SCAN_WALLS // 2, 4 * LINEAR_SCAN_WALLS):
+        walls = random_rects(rng, n_walls, 120)
+        index = WallIndex(walls)
+        for rect in random_rects(rng, 2000, 150):
+            expected = [wall for wall in walls if rect.colliderect(wall)]
+            # Queries may return extra candidates, but in wall order and including every overlap
+            assert [wall for wall in index.query(rect) if rect.colliderect(wall)] == expected
+            assert index.collides(rect) == bool(expected)
+
+
+def test_collides_many_matches_linear_scan():
+    rng = random.Random(1)
+    walls = random_rects(rng, 60, 120)
+    index = WallIndex(walls)
+    size = 5
+    x = np.array([rng.randrange(-20, WIDTH + 20) for _ in range(5000)])
+    y = np.array([rng.randrange(-20, HEIGHT + 20) for _ in range(5000)])
+    expected = [any(pygame.Rect(bx, by, size, size).colliderect(wall) for wall in walls)
+                for bx, by in zip(x.tolist(), y.tolist())]
+    assert index.collides_many(x, y, size, size).tolist() == expected
+    assert index.collides_many(x.reshape(50, 100), y.reshape(50, 100), size, size).ravel().tolist() == expected